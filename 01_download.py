@@ -2,16 +2,42 @@ from typing import Optional
 
 import click
 
-from utils import FigshareClient, token_option
+from figshare_client import FigshareClient, token_option
+from metrics import metrics_option, profile_option, record_run, stage
+from network import rate_limit_option, retries_option, workers_option
+from storage import backend_option
+from utils import batch_size_option, incremental_option, jobs_option
 
 
 @click.command()
 @token_option
-def main(token: Optional[str]):
-    api = FigshareClient(token=token)
-    api.download_short()
-    api.download_full()
-    api.process_articles()
+@backend_option
+@incremental_option
+@jobs_option
+@batch_size_option
+@workers_option
+@rate_limit_option
+@retries_option
+@click.option('--sync', is_flag=True, help='Only list articles modified since the last sync')
+@click.option('--refresh', is_flag=True, help='Re-check already downloaded articles, only fetching ones that changed')
+@click.option('--base', default=FigshareClient.base, show_default=True, help='The base URL of the Figshare API')
+@metrics_option
+@profile_option
+def main(
+    token: Optional[str], backend: str, incremental: bool, jobs: int, batch_size: Optional[int], workers: int,
+    rate_limit: Optional[float], retries: int, sync: bool, refresh: bool, base: str, metrics_path: Optional[str],
+    profile_directory: Optional[str],
+):
+    api = FigshareClient(
+        token=token, workers=workers, rate_limit=rate_limit, backend=backend, retries=retries, base=base,
+    )
+    with record_run(metrics_path, profile_directory):
+        with stage('figshare_listing'):
+            api.download_short(sync=sync)
+        with stage('figshare_articles'):
+            api.download_full(refresh=refresh)
+        with stage('summarize'):
+            api.process_articles(incremental=incremental, jobs=jobs, batch_size=batch_size)
 
 
 if __name__ == '__main__':
@@ -2,14 +2,27 @@ from typing import Optional
 
 import click
 
-from utils import FigshareClient, token_option
+from figshare_client import FigshareClient, token_option
+from metrics import metrics_option, profile_option, record_run, stage
+from storage import backend_option
+from utils import batch_size_option, incremental_option, jobs_option
 
 
 @click.command()
 @token_option
-def main(token: Optional[str]):
-    api = FigshareClient(token=token)
-    api.process_articles()
+@backend_option
+@incremental_option
+@jobs_option
+@batch_size_option
+@metrics_option
+@profile_option
+def main(
+    token: Optional[str], backend: str, incremental: bool, jobs: int, batch_size: Optional[int],
+    metrics_path: Optional[str], profile_directory: Optional[str],
+):
+    api = FigshareClient(token=token, backend=backend)
+    with record_run(metrics_path, profile_directory), stage('summarize'):
+        api.process_articles(incremental=incremental, jobs=jobs, batch_size=batch_size)
 
 
 if __name__ == '__main__':
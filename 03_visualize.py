@@ -1,29 +1,89 @@
-from typing import Optional
+import os
+import time
+from typing import Optional, Sequence
 
 import click
+import pandas as pd
 
-from utils import (
-    FigshareClient, plot_cumulative_authors, plot_cumulative_licenses,
-    plot_first_time_first_authors_by_month, plot_gender_evolution, plot_gender_male_percentage, plot_papers_by_month,
-    plot_prolific_authors, plot_unique_authors_per_month, plot_x, token_option,
+from aggregates import MonthlyAggregates, get_aggregates
+from figshare_client import FigshareClient, token_option
+from metrics import metrics_option, profile_option, record_run, stage
+from plots import (
+    plot_cumulative_authors, plot_cumulative_licenses, plot_first_time_first_authors_by_month, plot_gender_evolution,
+    plot_gender_male_percentage, plot_papers_by_month, plot_prolific_authors, plot_unique_authors_per_month, plot_x,
 )
+from rendering import (
+    clear_render_cache, dpi_option, force_option, formats_option, render_charts, render_workers_option,
+)
+from summary import get_df_with_diagnostics
+
+PLOTS = [
+    plot_unique_authors_per_month,
+    plot_papers_by_month,
+    plot_x,
+    plot_prolific_authors,
+    plot_cumulative_authors,
+    plot_cumulative_licenses,
+    plot_first_time_first_authors_by_month,
+    plot_gender_evolution,
+    plot_gender_male_percentage,
+]
 
 
 @click.command()
 @token_option
-def main(token: Optional[str]):
+@render_workers_option
+@formats_option
+@dpi_option
+@force_option
+@metrics_option
+@profile_option
+def main(
+    token: Optional[str], workers: int, formats: Sequence[str], dpi: int, force: bool, metrics_path: Optional[str],
+    profile_directory: Optional[str],
+):
     client = FigshareClient(token=token)
-    df = client.get_df()
-
-    plot_unique_authors_per_month(df, client.institution_directory, institution_name=client.institution_name)
-    plot_papers_by_month(df, client.institution_directory, institution_name=client.institution_name)
-    plot_x(df, client.institution_directory, institution_name=client.institution_name)
-    plot_prolific_authors(df, client.institution_directory, institution_name=client.institution_name)
-    plot_cumulative_authors(df, client.institution_directory, institution_name=client.institution_name)
-    plot_cumulative_licenses(df, client.institution_directory, institution_name=client.institution_name)
-    plot_first_time_first_authors_by_month(df, client.institution_directory, institution_name=client.institution_name)
-    plot_gender_evolution(df, client.institution_directory, institution_name=client.institution_name)
-    plot_gender_male_percentage(df, client.institution_directory, institution_name=client.institution_name)
+    with record_run(metrics_path, profile_directory):
+        with stage('aggregate'):
+            aggregates = aggregate(client)
+        with stage('render'):
+            render(client, aggregates, workers=workers, formats=formats, dpi=dpi, force=force)
+
+
+def aggregate(client: FigshareClient) -> MonthlyAggregates:
+    """Get the monthly aggregates of the institution's summary, only loading it if it changed."""
+    def _load() -> pd.DataFrame:
+        df, orcid_problems = get_df_with_diagnostics(
+            client.institution_directory, columns=['id', 'time', 'license', 'first_author_inferred_gender'],
+        )
+        # Some problems, like missing hyphens, are reported but the articles are kept
+        skipped = (~orcid_problems['id'].isin(df['id'])).sum()
+        if skipped:
+            click.echo(f'Skipped {skipped} articles with malformed ORCIDs')
+        return df
+
+    return get_aggregates(os.path.join(client.institution_directory, 'articles_summary.tsv'), load=_load)
+
+
+def render(
+    client: FigshareClient, aggregates: MonthlyAggregates, *, workers: int, formats: Sequence[str], dpi: int,
+    force: bool,
+) -> None:
+    """Render each chart whose data changed, or all of them if forced."""
+    if force:
+        clear_render_cache(client.institution_directory)
+
+    start = time.perf_counter()
+    charts = [
+        (plot, dict(
+            aggregates=aggregates,
+            directory=client.institution_directory,
+            institution_name=client.institution_name,
+        ))
+        for plot in PLOTS
+    ]
+    render_charts(charts, workers=workers, formats=formats, dpi=dpi)
+    click.echo(f'Rendered {len(charts)} charts in {time.perf_counter() - start:.2f}s')
 
 
 if __name__ == '__main__':
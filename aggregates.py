@@ -0,0 +1,134 @@
+"""Monthly aggregates that all of the charts are drawn from.
+
+The raw rows of a summary are only grouped once per dataset. The results are
+cached next to the summary, like ``articles_summary.aggregates.pkl``, and are
+rebuilt when the summary changes.
+"""
+
+import os
+import pickle
+import threading
+from typing import Callable, Optional
+
+import pandas as pd
+
+from storage import TEMPORARY_SUFFIX
+
+#: Bump this when the aggregates change so old caches get rebuilt
+AGGREGATES_VERSION = 1
+
+#: The columns that get counted per month, if they're in the summary
+COUNTED_COLUMNS = ('license', 'first_author_inferred_gender', 'category')
+
+
+class MonthlyAggregates:
+    """Counts per month, and per first author when ORCIDs are available.
+
+    The month tables are indexed by ``time`` and have a column for each value, for example
+    ``licenses`` has a column for each license. Anything not in the summary is None.
+    """
+
+    def __init__(
+        self,
+        articles: pd.Series,
+        licenses: Optional[pd.DataFrame] = None,
+        genders: Optional[pd.DataFrame] = None,
+        categories: Optional[pd.DataFrame] = None,
+        unique_authors: Optional[pd.Series] = None,
+        first_time_authors: Optional[pd.Series] = None,
+        author_frequencies: Optional[pd.Series] = None,
+    ):
+        #: The number of articles each month
+        self.articles = articles
+        #: The number of articles each month with each license
+        self.licenses = licenses
+        #: The number of articles each month with each inferred first author gender
+        self.genders = genders
+        #: The number of articles each month in each category
+        self.categories = categories
+        #: The number of unique first authors each month
+        self.unique_authors = unique_authors
+        #: The number of first authors whose first article was each month
+        self.first_time_authors = first_time_authors
+        #: The number of articles by each first author, indexed by ORCID
+        self.author_frequencies = author_frequencies
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> 'MonthlyAggregates':
+        """Aggregate a summary, which needs at least the ``time`` column."""
+        keys = [column for column in COUNTED_COLUMNS if column in df.columns]
+        counts = df.groupby(['time', *keys], observed=True, dropna=False).size()
+
+        def _count(column: str) -> Optional[pd.DataFrame]:
+            if column not in keys:
+                return None
+            return counts.groupby(level=['time', column], observed=True).sum().unstack(fill_value=0)
+
+        unique_authors = first_time_authors = author_frequencies = None
+        if 'orcid' in df.columns:
+            author_months = df.groupby(['orcid', 'time']).size()
+            unique_authors = author_months.groupby(level='time').size()
+            first_months = author_months.index.to_frame(index=False).groupby('orcid')['time'].min()
+            first_time_authors = first_months.value_counts().sort_index().rename_axis('time')
+            author_frequencies = author_months.groupby(level='orcid').sum()
+
+        return cls(
+            articles=counts.groupby(level='time').sum(),
+            licenses=_count('license'),
+            genders=_count('first_author_inferred_gender'),
+            categories=_count('category'),
+            unique_authors=unique_authors,
+            first_time_authors=first_time_authors,
+            author_frequencies=author_frequencies,
+        )
+
+
+def get_aggregates(path: str, load: Callable[[], pd.DataFrame]) -> MonthlyAggregates:
+    """Get the aggregates for a summary, only loading and grouping it if it changed since they were cached.
+
+    :param path: The summary's TSV file. Its Parquet version is also checked for changes.
+    :param load: A function that loads the summary's rows
+    """
+    cache_path = get_aggregates_path(path)
+    fingerprint = _get_fingerprint(path)
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as file:
+                cached_fingerprint, aggregates = pickle.load(file)
+        except (EOFError, pickle.UnpicklingError):
+            pass  # a cache that's cut off is rebuilt like one that's stale
+        else:
+            if cached_fingerprint == fingerprint:
+                return aggregates
+
+    aggregates = MonthlyAggregates.from_df(load())
+    _write_pickle(cache_path, (fingerprint, aggregates))
+    return aggregates
+
+
+def _write_pickle(path: str, obj) -> None:
+    """Pickle an object to a file atomically, like :func:`storage.write_json`."""
+    directory, name = os.path.split(path)
+    temporary_path = os.path.join(directory, f'.{name}.{os.getpid()}.{threading.get_ident()}{TEMPORARY_SUFFIX}')
+    try:
+        with open(temporary_path, 'wb') as file:
+            pickle.dump(obj, file)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def get_aggregates_path(path: str) -> str:
+    """Get the path of the cached aggregates for a summary."""
+    return f'{os.path.splitext(path)[0]}.aggregates.pkl'
+
+
+def _get_fingerprint(path: str):
+    stem = os.path.splitext(path)[0]
+    return AGGREGATES_VERSION, [
+        (os.path.basename(p), os.stat(p).st_mtime_ns, os.stat(p).st_size)
+        for p in (path, f'{stem}.parquet')
+        if os.path.exists(p)
+    ]
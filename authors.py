@@ -0,0 +1,320 @@
+"""An index of every author of every article, for looking up authors without the raw records.
+
+The process steps write an author table with a row for each author position of each article,
+like ``articles_summary.authors.parquet``, and build an index from it next to the summary, like
+``articles_summary.authors.npz``. Author names (after normalization) and ORCIDs are interned
+into integer ids, sorted so they can be found with a binary search. The postings are stored as
+compressed sparse rows (an array of offsets into an array of ids) in both directions, from each
+article to its authors and from each name and ORCID to its articles.
+
+Strings are stored as one UTF-8 buffer and an array of offsets, so loading the index doesn't
+parse anything and only the strings that are looked at get decoded. Look up authors with
+``python authors.py "Jane Doe"`` or ``python authors.py 0000-0002-1825-0097 --coauthors``.
+"""
+
+import os
+import re
+import unicodedata
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import click
+import numpy as np
+
+from utils import BIORXIV_SUMMARY_PATH
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+#: The columns of an author table
+AUTHOR_COLUMNS = ['id', 'position', 'name', 'orcid']
+
+ORCID_PATTERN = re.compile(r'^\d{4}-\d{4}-\d{4}-\d{3}[\dX]$')
+
+
+class PackedStrings(Sequence[str]):
+    """Strings stored as one UTF-8 buffer and the offsets of each string in it."""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: Iterable[str]) -> 'PackedStrings':
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    @classmethod
+    def concatenate(cls, parts: Sequence['PackedStrings']) -> 'PackedStrings':
+        """Join packed strings one after the other."""
+        if not parts:
+            return cls.from_strings([])
+        starts = np.cumsum([0, *(len(part.data) for part in parts[:-1])])
+        offsets = [part.offsets[:-1] + start for part, start in zip(parts, starts)]
+        return cls(
+            np.concatenate([part.data for part in parts]),
+            np.concatenate([*offsets, [starts[-1] + len(parts[-1].data)]]).astype(np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def find(self, string: str) -> Optional[int]:
+        """Get the position of a string, if they're sorted."""
+        i = bisect_left(self, string)
+        if i < len(self) and self[i] == string:
+            return i
+        return None
+
+
+LAST_NAME_FIRST_PATTERN = re.compile(r'^\s*([^,]+),\s*(.+)$')
+PUNCTUATION_PATTERN = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_name(name: str) -> str:
+    """Normalize an author name so different spellings of the same name match.
+
+    Accents, case, and punctuation are removed, and names written last name first
+    (with a comma) are flipped, so ``Müller, J.`` and ``J Muller`` are both ``j muller``.
+    """
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii').lower()
+    name = LAST_NAME_FIRST_PATTERN.sub(r'\2 \1', name)
+    return PUNCTUATION_PATTERN.sub(' ', name).strip()
+
+
+def _hash_ids(ids: 'pd.Series') -> np.ndarray:
+    import pandas as pd
+
+    return pd.util.hash_array(ids.to_numpy(dtype=object))
+
+
+class _HashLookup:
+    """Find the position of each hash in an array of them, without keeping the strings they're hashes of."""
+
+    def __init__(self, hashes: np.ndarray):
+        self.order = np.argsort(hashes, kind='stable')
+        self.hashes = hashes[self.order]
+
+    def get(self, hashes: np.ndarray) -> np.ndarray:
+        """Get the position of each hash, or -1 for the ones that aren't there."""
+        if not len(self.hashes):
+            return np.full(len(hashes), -1, dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        return np.where(self.hashes[i] == hashes, self.order[i], -1)
+
+
+def _sort_ids(ids: Mapping[str, int], values: np.ndarray) -> Tuple[List[str], np.ndarray]:
+    """Sort strings that were given ids in the order they were seen, and renumber the values, keeping -1 missing."""
+    strings = sorted(ids)
+    ranks = np.empty(len(strings), dtype=values.dtype)
+    ranks[[ids[string] for string in strings]] = np.arange(len(strings))
+    return strings, np.where(0 <= values, ranks[np.maximum(values, 0)] if len(strings) else -1, -1)
+
+
+def _get_csr(keys: np.ndarray, values: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Group the values by key into offsets and postings. Keys are in ``[0, size)``, missing ones are -1."""
+    present = 0 <= keys
+    keys, values = keys[present], values[present]
+    order = np.argsort(keys, kind='stable')
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=size), out=offsets[1:])
+    return offsets, values[order].astype(np.int32)
+
+
+class AuthorIndex:
+    """Articles and their authors, interned and indexed by normalized name and ORCID."""
+
+    def __init__(self, arrays: Mapping[str, np.ndarray]):
+        self.arrays = arrays
+        self.article_ids = PackedStrings(arrays['article_ids_data'], arrays['article_ids_offsets'])
+        self.titles = PackedStrings(arrays['titles_data'], arrays['titles_offsets'])
+        self.posted = PackedStrings(arrays['posted_data'], arrays['posted_offsets'])
+        #: The distinct normalized names, sorted
+        self.names = PackedStrings(arrays['names_data'], arrays['names_offsets'])
+        #: How each normalized name was first written
+        self.display_names = PackedStrings(arrays['display_names_data'], arrays['display_names_offsets'])
+        #: The distinct ORCIDs, sorted
+        self.orcids = PackedStrings(arrays['orcids_data'], arrays['orcids_offsets'])
+
+    @classmethod
+    def from_tables(cls, articles: 'pd.DataFrame', authors: 'pd.DataFrame') -> 'AuthorIndex':
+        """Build an index from a summary's ``id``, ``title``, and ``posted`` columns and its author table."""
+        return cls.from_chunks([articles], [authors])
+
+    @classmethod
+    def from_chunks(cls, articles: Iterable['pd.DataFrame'], authors: Iterable['pd.DataFrame']) -> 'AuthorIndex':
+        """Build an index like :meth:`from_tables` from chunks of the summary's columns and of the author table.
+
+        Only the index itself is kept in memory, so both tables can be read a chunk at a time. All
+        of the articles are read before the first author.
+        """
+        import pandas as pd
+
+        article_ids, titles, posted, id_hashes = [], [], [], []
+        for df in articles:
+            ids = df['id'].astype(str)
+            article_ids.append(PackedStrings.from_strings(ids))
+            titles.append(PackedStrings.from_strings(df['title'].fillna('').astype(str)))
+            posted.append(PackedStrings.from_strings(df['posted'].astype(str).str.slice(0, 10)))
+            id_hashes.append(_hash_ids(ids))
+        article_lookup = _HashLookup(np.concatenate([np.empty(0, dtype=np.uint64), *id_hashes]))
+
+        names: Dict[str, int] = {}  # each normalized name's id, in the order they're first seen
+        orcids: Dict[str, int] = {}
+        #: The (article, position, spelling) of each name's first author, in the order of the articles
+        spellings: Dict[int, Tuple[int, int, str]] = {}
+        parts: Dict[str, List[np.ndarray]] = {'articles': [], 'positions': [], 'names': [], 'orcids': []}
+        for df in authors:
+            article_codes = article_lookup.get(_hash_ids(df['id'].astype(str))).astype(np.int32)
+            normalized = df['name'].fillna('').astype(str).map(normalize_name).to_numpy()
+            keep = (0 <= article_codes) & (normalized != '')
+            df, article_codes, normalized = df[keep], article_codes[keep], normalized[keep]
+            positions = df['position'].to_numpy(dtype=np.int32)
+            name_ids = np.fromiter(
+                (names.setdefault(name, len(names)) for name in normalized), dtype=np.int32, count=len(normalized),
+            )
+            orcid_ids = np.fromiter(
+                (-1 if pd.isna(orcid) else orcids.setdefault(orcid, len(orcids)) for orcid in df['orcid']),
+                dtype=np.int32, count=len(df.index),
+            )
+            order = np.lexsort((positions, article_codes))
+            _, first = np.unique(name_ids[order], return_index=True)
+            spelled = df['name'].astype(str).to_numpy()
+            for i in order[first]:
+                key = article_codes[i], positions[i]
+                name_id = name_ids[i]
+                if name_id not in spellings or key < spellings[name_id][:2]:
+                    spellings[name_id] = (*key, spelled[i])
+            for key, values in [
+                ('articles', article_codes), ('positions', positions), ('names', name_ids), ('orcids', orcid_ids),
+            ]:
+                parts[key].append(values)
+
+        # The arrays have a value per author, so they're kept as small as they can be
+        article_codes, positions, name_ids, orcid_ids = (
+            np.concatenate([np.empty(0, dtype=np.int32), *parts.pop(key)])
+            for key in ('articles', 'positions', 'names', 'orcids')
+        )
+        # Keep each article's authors in order so the article to author postings are too
+        order = np.lexsort((positions, article_codes))
+        del positions
+        article_codes, name_ids, orcid_ids = article_codes[order], name_ids[order], orcid_ids[order]
+        del order
+        sorted_names, name_codes = _sort_ids(names, name_ids)
+        sorted_orcids, orcid_codes = _sort_ids(orcids, orcid_ids)
+        del name_ids, orcid_ids
+
+        arrays = {}
+        for key, packed in [
+            ('article_ids', PackedStrings.concatenate(article_ids)),
+            ('titles', PackedStrings.concatenate(titles)),
+            ('posted', PackedStrings.concatenate(posted)),
+            ('names', PackedStrings.from_strings(sorted_names)),
+            ('display_names', PackedStrings.from_strings(spellings[names[name]][2] for name in sorted_names)),
+            ('orcids', PackedStrings.from_strings(sorted_orcids)),
+        ]:
+            arrays[f'{key}_data'], arrays[f'{key}_offsets'] = packed.data, packed.offsets
+
+        n_articles = len(arrays['article_ids_offsets']) - 1
+        arrays['article_offsets'] = np.zeros(n_articles + 1, dtype=np.int64)
+        np.cumsum(np.bincount(article_codes, minlength=n_articles), out=arrays['article_offsets'][1:])
+        arrays['article_names'] = name_codes.astype(np.int32)
+        arrays['article_orcids'] = orcid_codes.astype(np.int32)
+        arrays['name_offsets'], arrays['name_articles'] = _get_csr(name_codes, article_codes, len(sorted_names))
+        arrays['orcid_offsets'], arrays['orcid_articles'] = _get_csr(orcid_codes, article_codes, len(sorted_orcids))
+        return cls(arrays)
+
+    def save(self, path: str) -> None:
+        """Write the index as an uncompressed ``.npz`` file, which loads without any decoding."""
+        temporary_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(temporary_path, **self.arrays)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'AuthorIndex':
+        with np.load(path) as npz:
+            return cls({key: npz[key] for key in npz.files})
+
+    def _get_postings(self, query: str) -> Tuple[str, Optional[int]]:
+        """Get whether the query is an ORCID or a name, and its interned id if it's in the index."""
+        query = query.strip()
+        if ORCID_PATTERN.match(query):
+            return 'orcid', self.orcids.find(query)
+        return 'name', self.names.find(normalize_name(query))
+
+    def get_articles(self, query: str) -> List[int]:
+        """Get the positions of the articles by an author, given by ORCID or name, in the order of the summary."""
+        kind, code = self._get_postings(query)
+        if code is None:
+            return []
+        offsets, articles = self.arrays[f'{kind}_offsets'], self.arrays[f'{kind}_articles']
+        return np.unique(articles[offsets[code]:offsets[code + 1]]).tolist()
+
+    def get_article(self, i: int) -> Tuple[str, str, str]:
+        """Get the id, posted date, and title of the article at a position."""
+        return self.article_ids[i], self.posted[i], self.titles[i]
+
+    def get_authors(self, i: int) -> List[str]:
+        """Get the names of the authors of the article at a position, in order."""
+        start, end = self.arrays['article_offsets'][i:i + 2]
+        return [self.display_names[code] for code in self.arrays['article_names'][start:end]]
+
+    def get_coauthors(self, query: str) -> List[Tuple[str, int]]:
+        """Get the names of an author's co-authors and how many articles they share, most frequent first."""
+        kind, code = self._get_postings(query)
+        if code is None:
+            return []
+        own = self.arrays[f'article_{kind}s']
+        offsets = self.arrays['article_offsets']
+        names = []
+        for i in self.get_articles(query):
+            start, end = offsets[i], offsets[i + 1]
+            article_names = self.arrays['article_names'][start:end]
+            names.append(np.unique(article_names[own[start:end] != code]))
+        if not names:
+            return []
+        codes, counts = np.unique(np.concatenate(names), return_counts=True)
+        order = np.lexsort((codes, -counts))
+        return [(self.display_names[codes[i]], int(counts[i])) for i in order]
+
+
+def get_author_paths(path: str) -> Tuple[str, str]:
+    """Get the paths of the author table and index for a summary."""
+    stem = os.path.splitext(path)[0]
+    return f'{stem}.authors.parquet', f'{stem}.authors.npz'
+
+
+def get_author_rows(article_id, authors: Sequence[Tuple[str, Optional[str]]]) -> List[tuple]:
+    """Get the rows of the author table for an article's (name, ORCID) pairs."""
+    return [(article_id, position, name, orcid) for position, (name, orcid) in enumerate(authors)]
+
+
+@click.command()
+@click.argument('query')
+@click.option('--coauthors', is_flag=True, help='List the co-authors instead of the articles')
+@click.option(
+    '--index', 'path', type=click.Path(dir_okay=False, exists=True),
+    default=get_author_paths(BIORXIV_SUMMARY_PATH)[1], show_default=True,
+    help='The index to search, like figshare/chemrxiv/articles_summary.authors.npz',
+)
+def main(query: str, coauthors: bool, path: str):
+    """Find the articles by, or the co-authors of, the author with the ORCID or name QUERY."""
+    index = AuthorIndex.load(path)
+    if coauthors:
+        for name, count in index.get_coauthors(query):
+            click.echo(f'{count}\t{name}')
+        return
+    for i in index.get_articles(query):
+        article_id, posted, title = index.get_article(i)
+        click.echo(f'{posted}\t{article_id}\t{title}')
+
+
+if __name__ == '__main__':
+    main()
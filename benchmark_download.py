@@ -0,0 +1,117 @@
+"""Benchmark each download stage against the mock API in :mod:`mock_api`.
+
+Everything is downloaded into a temporary directory, so this doesn't touch any
+real crawl. For each stage, the number of requests, requests per second, bytes
+per second, and end-to-end time are reported, like with
+``python benchmark_download.py --workers 8 --latency 0.05``.
+"""
+
+import datetime
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import click
+
+import biorxiv_01_download_days
+import biorxiv_02_download_articles
+import figshare_client
+import utils
+from mock_api import MockAPI
+from network import workers_option
+from storage import BACKENDS
+
+
+@click.command()
+@workers_option
+@click.option('--latency', type=float, default=0.02, show_default=True, help='Seconds to delay each response by')
+@click.option('--error-rate', type=float, default=0.0, show_default=True, help='Fraction of requests that get a 503')
+@click.option('--figshare-articles', type=int, default=2000, show_default=True)
+@click.option('--days', type=int, default=30, show_default=True, help='Number of bioRxiv days to crawl')
+@click.option('--articles-per-day', type=int, default=20, show_default=True, help='bioRxiv articles per day')
+@click.option('--adaptive', is_flag=True, help='Crawl the bioRxiv days in adaptive multi-day windows')
+@click.option('--bulk', is_flag=True, help='Harvest the bioRxiv article details by date range')
+@click.option('--backend', type=click.Choice(BACKENDS), default='directory', show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results as JSON to this file')
+def main(
+    workers: int, latency: float, error_rate: float, figshare_articles: int, days: int, articles_per_day: int,
+    adaptive: bool, bulk: bool, backend: str, output: Optional[str],
+):
+    """Time each download stage against a local mock API."""
+    api = MockAPI(
+        latency=latency, error_rate=error_rate, figshare_articles=figshare_articles, articles_per_day=articles_per_day,
+    )
+    server = api.serve()
+    url = f'http://127.0.0.1:{server.server_port}'
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        _set_directories(directory)
+        client = figshare_client.FigshareClient(token='benchmark', workers=workers, backend=backend, base=f'{url}/v2')
+        end = datetime.date(2020, 1, 1) + datetime.timedelta(days=days + 1)
+        stages: List[tuple] = [
+            ('figshare listing', client.download_short),
+            ('figshare articles', client.download_full),
+            ('figshare refresh', lambda: client.download_full(refresh=True)),
+            ('biorxiv days', lambda: biorxiv_01_download_days.main.callback(
+                start=datetime.datetime(2020, 1, 1), end=datetime.datetime.combine(end, datetime.time()),
+                workers=workers, rate_limit=None, retries=5, endpoint=f'{url}/pub', adaptive=adaptive,
+            )),
+            ('biorxiv articles', lambda: biorxiv_02_download_articles.main.callback(
+                workers=workers, rate_limit=None, retries=5, backend=backend, endpoint=f'{url}/details/biorxiv',
+                bulk=bulk,
+            )),
+        ]
+        for name, func in stages:
+            results.append(_run(name, func, api))
+    server.shutdown()
+
+    click.echo(f'{"stage":<20} {"requests":>9} {"errors":>7} {"seconds":>8} {"req/s":>9} {"MB/s":>8}')
+    for result in results:
+        click.echo(
+            f'{result["stage"]:<20} {result["requests"]:>9} {result["errors"]:>7} {result["seconds"]:>8.2f}'
+            f' {result["requests_per_second"]:>9.1f} {result["bytes_per_second"] / 1e6:>8.2f}'
+        )
+    click.echo(f'Total time: {sum(result["seconds"] for result in results):.2f}s')
+    if output:
+        with open(output, 'w') as file:
+            json.dump(
+                dict(
+                    workers=workers, latency=latency, error_rate=error_rate, adaptive=adaptive, bulk=bulk,
+                    backend=backend,
+                    stages=results,
+                ),
+                file, indent=2,
+            )
+
+
+def _set_directories(directory: str) -> None:
+    """Point the crawlers' output at the given directory."""
+    figshare_client.FIGSHARE_DIRECTORY = os.path.join(directory, 'figshare')
+    metadata_directory = os.path.join(directory, 'biorxiv', 'metadata')
+    biorxiv_01_download_days.BIORXIV_METADATA_DIRECTORY = metadata_directory
+    biorxiv_02_download_articles.BIORXIV_METADATA_DIRECTORY = metadata_directory
+    biorxiv_02_download_articles.BIORXIV_DIRECTORY = os.path.join(directory, 'biorxiv')
+    utils.BIORXIV_DIRECTORY = os.path.join(directory, 'biorxiv')
+    utils.BIORXIV_METADATA_DIRECTORY = metadata_directory
+    utils.BIORXIV_ARTICLES_DIRECTORY = os.path.join(directory, 'biorxiv', 'articles')
+
+
+def _run(name: str, func: Callable[[], Any], api: MockAPI) -> Dict[str, Any]:
+    api.reset_stats()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    stats = api.reset_stats()
+    return dict(
+        stage=name,
+        seconds=seconds,
+        requests_per_second=stats['requests'] / seconds,
+        bytes_per_second=stats['bytes'] / seconds,
+        **stats,
+    )
+
+
+if __name__ == '__main__':
+    main()
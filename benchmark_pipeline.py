@@ -0,0 +1,194 @@
+"""Benchmark the process and visualize stages on a synthetic corpus from :mod:`generate_corpus`.
+
+Each stage is timed separately and its peak resident memory is tracked:
+
+1. ``parse`` decodes and summarizes each record
+2. ``gender`` infers genders from the first names, starting from an empty cache
+3. ``write`` writes the TSV and Parquet summaries
+4. ``load`` reads the summary back like the visualize scripts
+5. ``aggregate`` builds the monthly aggregates
+6. ``render`` draws all of the charts
+
+The results are written as JSON so they can be compared between commits, like with
+``python benchmark_pipeline.py --source biorxiv --size 100000 --output before.json``.
+"""
+
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import click
+import pandas as pd
+
+import biorxiv_03_process
+import biorxiv_04_visualize
+from aggregates import MonthlyAggregates
+from authors import get_author_rows
+from gender import GenderCache
+from generate_corpus import SOURCES, generate_corpus, get_corpus_store
+from rendering import dpi_option, formats_option, render_charts, render_workers_option
+from storage import backend_option
+from summary import (
+    get_df_with_diagnostics, get_figshare_first_names, get_figshare_row, iter_rows, read_summary, write_summary,
+)
+from utils import HERE, jobs_option
+
+#: How often the resident memory is sampled, in seconds
+SAMPLE_INTERVAL = 0.01
+
+
+class PeakMemory:
+    """Track the peak resident memory of this process while in the context, by sampling it in a thread."""
+
+    def __init__(self):
+        self.peak = 0
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self) -> 'PeakMemory':
+        self.peak = _get_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, _get_rss())
+
+    def _sample(self) -> None:
+        while not self._done.wait(SAMPLE_INTERVAL):
+            self.peak = max(self.peak, _get_rss())
+
+
+def _get_rss() -> int:
+    """Get the current resident memory in bytes, or the peak so far where ``/proc`` isn't available."""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return _get_rss_peak(resource.RUSAGE_SELF)
+
+
+@click.command()
+@click.option('--source', type=click.Choice(SOURCES), default='figshare', show_default=True)
+@click.option('--size', type=int, default=10_000, show_default=True, help='Number of articles, like 10000 or 1000000')
+@click.option(
+    '--corpus', type=click.Path(file_okay=False, dir_okay=True),
+    help='Directory of a corpus made by generate_corpus.py. By default, one is generated in a temporary directory.',
+)
+@backend_option
+@jobs_option
+@render_workers_option
+@formats_option
+@dpi_option
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results as JSON to this file')
+def main(
+    source: str, size: int, corpus: Optional[str], backend: str, jobs: int, workers: int, formats: Sequence[str],
+    dpi: int, output: Optional[str],
+):
+    """Time each process and visualize stage on a synthetic corpus."""
+    with tempfile.TemporaryDirectory() as directory:
+        if corpus is None:
+            corpus = os.path.join(directory, 'corpus')
+            generate_corpus(corpus, source, size, backend)
+        results = benchmark(corpus, os.path.join(directory, 'output'), source, backend, jobs, workers, formats, dpi)
+
+    results = dict(
+        commit=_get_commit(),
+        source=source,
+        size=size,
+        backend=backend,
+        jobs=jobs,
+        workers=workers,
+        formats=list(formats),
+        dpi=dpi,
+        stages=results,
+        max_rss_bytes=_get_rss_peak(resource.RUSAGE_SELF),
+        max_child_rss_bytes=_get_rss_peak(resource.RUSAGE_CHILDREN),
+    )
+    for stage in results['stages']:
+        click.echo(f'{stage["stage"]:<10} {stage["seconds"]:>8.2f}s {stage["peak_rss_bytes"] / 2 ** 20:>8.1f} MiB')
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        click.echo(json.dumps(results, indent=2))
+
+
+def benchmark(
+    corpus: str, directory: str, source: str, backend: str, jobs: int, workers: int, formats: Sequence[str], dpi: int,
+) -> List[Dict[str, Any]]:
+    """Run each stage on the corpus, writing into the given directory, and get their times and peak memory."""
+    os.makedirs(directory, exist_ok=True)
+    if source == 'figshare':
+        get_row, get_first_names, sort_by = get_figshare_row, get_figshare_first_names, 'id'
+        path = os.path.join(directory, 'articles_summary.tsv')
+        plots = importlib.import_module('03_visualize').PLOTS
+        plot_kwargs = dict(institution_name='benchmark')
+
+        def _load() -> pd.DataFrame:
+            return get_df_with_diagnostics(
+                directory, columns=['id', 'time', 'license', 'first_author_inferred_gender'],
+            )[0]
+    else:
+        get_row, get_first_names, sort_by = biorxiv_03_process.get_row, biorxiv_03_process.get_first_names, 'posted'
+        path = os.path.join(directory, 'articles.tsv')
+        plots = biorxiv_04_visualize.PLOTS
+        plot_kwargs = dict(institution_name='biorxiv', figsize=(14, 6))
+
+        def _load() -> pd.DataFrame:
+            return read_summary(path, columns=biorxiv_04_visualize.COLUMNS)
+
+    results = []
+
+    def _run(stage: str, func: Callable[[], Any]) -> Any:
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            rv = func()
+            seconds = time.perf_counter() - start
+        results.append(dict(stage=stage, seconds=seconds, peak_rss_bytes=memory.peak))
+        return rv
+
+    def _parse() -> pd.DataFrame:
+        rows, author_rows = [], []
+        with get_corpus_store(corpus, source, backend) as store:
+            for _, row in iter_rows(store.iter_raw(), get_row=get_row, loads=store.loads, jobs=jobs or os.cpu_count()):
+                if row is not None:
+                    # Like in build_summary, the authors go in their own table rather than a column of the summary
+                    author_rows.extend(get_author_rows(row['id'], row.pop('authors', [])))
+                    rows.append(row)
+        return pd.DataFrame(rows)
+
+    df = _run('parse', _parse)
+    genders = _run('gender', lambda: GenderCache(path=None).infer(get_first_names(df['first_author_name'])))
+    df.insert(df.columns.get_loc('first_author_name') + 1, 'first_author_inferred_gender', genders)
+    _run('write', lambda: write_summary(df.sort_values(list(dict.fromkeys([sort_by, 'id'])), kind='stable'), path))
+    loaded_df = _run('load', _load)
+    aggregates = _run('aggregate', lambda: MonthlyAggregates.from_df(loaded_df))
+    charts = [(plot, dict(aggregates=aggregates, directory=directory, **plot_kwargs)) for plot in plots]
+    _run('render', lambda: render_charts(charts, workers=workers, formats=formats, dpi=dpi))
+    return results
+
+
+def _get_rss_peak(who: int) -> int:
+    """Get the peak resident memory in bytes of this process or of its largest child."""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _get_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    main()
@@ -1,63 +1,257 @@
 """Get bioRxiv metadata.
 
+The metadata for each day ``d`` is saved in its own file with the publications from the window
+``[d - 1, d]``. By default, each day's window is requested separately. With ``--adaptive``, runs
+of missing days are requested in multi-day windows instead, which are widened when there are few
+publications and narrowed when there are many, then split back into the same day files. This
+takes far fewer requests for quiet stretches, and most publications are downloaded once rather
+than twice, since only the day before each window is also in the previous one.
+
 .. seealso:: https://api.biorxiv.org/
 """
 
 import datetime
-import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
 
+import click
 import requests
 from tqdm import tqdm
 
-logger = logging.getLogger(__name__)
+import metrics
+from metrics import metrics_option, profile_option, record_run, stage
+from network import RateLimiter, get_session, rate_limit_option, retries_option, workers_option
+from storage import write_json
+from utils import BIORXIV_METADATA_DIRECTORY, DAY, get_biorxiv_journal
 
-HERE = os.path.abspath(os.path.dirname(__file__))
-BIORXIV_DIRECTORY = os.path.join(HERE, 'biorxiv')
-BIORXIV_METADATA_DIRECTORY = os.path.join(BIORXIV_DIRECTORY, 'metadata')
-os.makedirs(BIORXIV_METADATA_DIRECTORY, exist_ok=True)
+logger = logging.getLogger(__name__)
 
 ENDPOINT = 'https://api.biorxiv.org/pub'
 
 # The internet claims it went online in November 2013
 STOP = datetime.date(year=2013, month=11, day=1)
 INTERVAL = 100
+#: The number of consecutive days crawled by a worker before it picks up another shard
+SHARD_DAYS = 30
+#: The most consecutive days crawled by a worker with ``--adaptive``, which needs long runs to widen its windows
+ADAPTIVE_SHARD_DAYS = 365
+#: The most days requested at once with ``--adaptive``
+MAX_WINDOW_DAYS = 64
+#: The number of publications each window aims for with ``--adaptive``. Wider windows waste less on the day
+#: before each window, which is also in the previous one, but hold more publications in memory until they're written.
+WINDOW_RECORDS = 20 * INTERVAL
+#: The date that publications are listed by, which is used to split windows into days
+DATE_FIELD = 'published_date'
+
+
+
+@click.command()
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), help=f'Oldest day to crawl. Defaults to {STOP}')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), help='Newest day to crawl. Defaults to today')
+@workers_option
+@rate_limit_option
+@retries_option
+@click.option('--endpoint', default=ENDPOINT, show_default=True, help='The URL of the bioRxiv publication API')
+@click.option(
+    '--adaptive', is_flag=True,
+    help='Request multi-day windows sized by how many publications there are, then split them into day files',
+)
+@metrics_option
+@profile_option
+def main(
+    start: Optional[datetime.datetime], end: Optional[datetime.datetime], workers: int, rate_limit: float, retries: int,
+    endpoint: str, adaptive: bool = False, metrics_path: Optional[str] = None, profile_directory: Optional[str] = None,
+):
+    """Download the bioRxiv publication metadata for each day, newest first."""
+    with record_run(metrics_path, profile_directory), stage('biorxiv_days'):
+        download_days(
+            start, end, workers=workers, rate_limit=rate_limit, retries=retries, endpoint=endpoint, adaptive=adaptive,
+        )
+
+
+def download_days(
+    start: Optional[datetime.datetime], end: Optional[datetime.datetime], *, workers: int, rate_limit: float,
+    retries: int, endpoint: str = ENDPOINT, adaptive: bool = False,
+) -> None:
+    """Download the metadata for each day that hasn't been downloaded yet, newest first, and journal the run."""
+    with get_biorxiv_journal().run('download_days'):
+        _download_days(
+            start, end, workers=workers, rate_limit=rate_limit, retries=retries, endpoint=endpoint, adaptive=adaptive,
+        )
+
 
+def _download_days(
+    start: Optional[datetime.datetime], end: Optional[datetime.datetime], *, workers: int, rate_limit: float,
+    retries: int, endpoint: str, adaptive: bool = False,
+) -> None:
+    all_days = list(_iter_days(start.date() if start else STOP, end.date() if end else datetime.date.today()))
+    days = [day for day in all_days if not os.path.exists(get_day_path(day))]
+    metrics.inc('biorxiv_days_total', len(all_days) - len(days), result='skipped')
+    if adaptive:
+        shards = [
+            span[i:i + ADAPTIVE_SHARD_DAYS]
+            for span in _get_spans(days)
+            for i in range(0, len(span), ADAPTIVE_SHARD_DAYS)
+        ]
+        download_shard = _download_span
+    else:
+        shards = [days[i:i + SHARD_DAYS] for i in range(0, len(days), SHARD_DAYS)]
+        download_shard = _download_shard
+    session = get_session(pool_size=workers, retries=retries)
+    rate_limiter = RateLimiter(rate_limit)
 
-def main():
-    delta = datetime.timedelta(days=1)
-    after = datetime.date.today()
-    before = after - delta
+    with tqdm(total=len(days), desc='Downloading bioRxiv metadata', unit='days') as it:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    download_shard, shard, session=session, rate_limiter=rate_limiter, it=it, endpoint=endpoint,
+                )
+                for shard in shards
+            ]
+            for future in futures:
+                future.result()
 
-    it = tqdm(desc='Downloading bioRxiv metadata', unit='days')
-    while STOP < before:
+
+def _iter_days(start: datetime.date, end: datetime.date) -> Iterable[datetime.date]:
+    """Iterate backwards over the days from ``end`` to ``start``, each of which has the window ``[day - 1, day]``."""
+    after = end
+    while start <= after:
+        yield after
+        after -= DAY
+
+
+def get_day_path(day: datetime.date) -> str:
+    """Get the path to the metadata file for the given day."""
+    return os.path.join(BIORXIV_METADATA_DIRECTORY, str(day.year), f'{day.month:02}', f'{day}.json')
+
+
+def _download_shard(
+    days: List[datetime.date], *, session: requests.Session, rate_limiter: RateLimiter, it: tqdm,
+    endpoint: str = ENDPOINT,
+):
+    for day in days:
+        _download_day(day, session=session, rate_limiter=rate_limiter, endpoint=endpoint)
         it.update()
-        url = f'{ENDPOINT}/{before}/{after}'
-        month_directory = os.path.join(BIORXIV_METADATA_DIRECTORY, str(after.year), f'{after.month:02}')
-        os.makedirs(month_directory, exist_ok=True)
-
-        date_str = f'{after.year}-{after.month:02}-{after.day:02}'
-        path = os.path.join(month_directory, f'{date_str}.json')
-        if not os.path.exists(path):
-            rz = []
-            page = 0
-            it.set_postfix({'date': date_str})
-            while True:
-                response = requests.get(f'{url}/{page * INTERVAL}')
-                response_json = response.json()
-                message = response_json['messages'][0]
-                if message.get('status') == 'no articles found':
-                    break
-                rz.extend(response_json['collection'])
-                if message['count'] < INTERVAL:
-                    break
-                page += 1
-
-            with open(path, 'w') as file:
-                json.dump(rz, file, indent=2)
-
-        before, after = before - delta, before
+
+
+def _get_spans(days: List[datetime.date]) -> List[List[datetime.date]]:
+    """Split days, newest first, into runs of consecutive days."""
+    spans = []
+    for day in days:
+        if spans and spans[-1][-1] - day == DAY:
+            spans[-1].append(day)
+        else:
+            spans.append([day])
+    return spans
+
+
+def _download_span(
+    days: List[datetime.date], *, session: requests.Session, rate_limiter: RateLimiter, it: tqdm,
+    endpoint: str = ENDPOINT,
+):
+    """Download consecutive days, newest first, in windows whose widths adapt to how many publications there are."""
+    width = 1
+    i = 0
+    while i < len(days):
+        window = days[i:i + width]
+        records = _get_records(
+            window[-1] - DAY, window[0], session=session, rate_limiter=rate_limiter, endpoint=endpoint,
+        )
+        records_by_day = _split_window(records, window)
+        if records_by_day is None:
+            # Some dates were missing or outside of the window, so get each day on its own to be safe
+            metrics.inc('biorxiv_windows_total', result='fallback')
+            for day in window:
+                _download_day(day, session=session, rate_limiter=rate_limiter, endpoint=endpoint)
+                it.update()
+        else:
+            metrics.inc('biorxiv_windows_total', result='split')
+            for day in window:
+                _write_day(day, records_by_day[day])
+                it.update()
+        i += len(window)
+        width = _get_next_width(width, len(records))
+
+
+def _split_window(records: List[dict], days: List[datetime.date]) -> Optional[Dict[datetime.date, List[dict]]]:
+    """Split the publications from the window ``[days[-1] - 1, days[0]]`` into the windows of each day.
+
+    Each publication is in the window of the day it's dated and the day after, like when each day's
+    window is requested on its own, and the publications keep their order.
+
+    :returns: The publications for each day, or None if any publication's date is missing or outside of the window
+    """
+    records_by_day: Dict[datetime.date, List[dict]] = {day: [] for day in days}
+    for record in records:
+        try:
+            day = datetime.date.fromisoformat(record[DATE_FIELD])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not days[-1] - DAY <= day <= days[0]:
+            return None
+        for after in (day, day + DAY):
+            if after in records_by_day:
+                records_by_day[after].append(record)
+    return records_by_day
+
+
+def _get_next_width(width: int, count: int) -> int:
+    """Get the width of the next window, aiming for :data:`WINDOW_RECORDS` publications.
+
+    The width at most doubles or halves each time, so a single busy or quiet day doesn't throw it off.
+    """
+    if not count:
+        return min(MAX_WINDOW_DAYS, width * 2)
+    return max(1, width // 2, min(MAX_WINDOW_DAYS, width * 2, width * WINDOW_RECORDS // count))
+
+
+def _download_day(
+    after: datetime.date, *, session: requests.Session, rate_limiter: RateLimiter, endpoint: str = ENDPOINT,
+) -> None:
+    rz = _get_records(after - DAY, after, session=session, rate_limiter=rate_limiter, endpoint=endpoint)
+    _write_day(after, rz)
+
+
+def _get_records(
+    start: datetime.date, end: datetime.date, *, session: requests.Session, rate_limiter: RateLimiter,
+    endpoint: str = ENDPOINT,
+) -> List[dict]:
+    """Get all pages of publications in the window ``[start, end]``."""
+    url = f'{endpoint.rstrip("/")}/{start}/{end}'
+    rz = []
+    page = 0
+    while True:
+        rate_limiter.acquire()
+        response = session.get(f'{url}/{page * INTERVAL}')
+        response.raise_for_status()
+        response_json = response.json()
+        message = response_json['messages'][0]
+        if message.get('status') == 'no articles found':
+            break
+        rz.extend(response_json['collection'])
+        if message['count'] < INTERVAL:
+            break
+        page += 1
+    return rz
+
+
+def _write_day(after: datetime.date, rz: List[dict]) -> None:
+    metrics.inc('biorxiv_days_total', result='fetched')
+    metrics.inc('biorxiv_day_articles_total', len(rz))
+    path = get_day_path(after)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_json(path, rz, indent=2)
+
+
+def get_day_problem(_key: str, records) -> Optional[str]:
+    """Get what's wrong with the contents of a day file, or None if it looks fine."""
+    if not isinstance(records, list):
+        return f'expected a list, got {type(records).__name__}'
+    if not all(isinstance(record, dict) and 'biorxiv_doi' in record for record in records):
+        return 'expected each entry to have a biorxiv_doi'
+    return None
 
 
 if __name__ == '__main__':
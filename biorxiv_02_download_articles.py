@@ -1,44 +1,409 @@
+"""Get the details of each bioRxiv article listed in the day files.
+
+By default, the details of each article are requested on their own, which takes a request per
+article. With ``--bulk``, the details of every article posted in the most recent date ranges are
+harvested a page of 100 versions at a time instead, going back for as long as that takes fewer
+requests than getting the articles in them on their own. The versions of the wanted articles are
+kept in ``biorxiv/details_harvest.sqlite`` until the harvest is done, so an interrupted harvest
+picks up where it left off, then each article's versions are saved as if they had been requested
+on their own. Articles whose first version wasn't harvested are still requested on their own.
+
+.. seealso:: https://api.biorxiv.org/
+"""
+
 import datetime
 import json
+import math
 import os
-from typing import Iterable, Tuple
+import queue
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Mapping, Optional, Set, Tuple
 
+import click
 import requests
 from tqdm import tqdm
 
-from biorxiv_01_download_days import BIORXIV_DIRECTORY, BIORXIV_METADATA_DIRECTORY
-
-ARTICLES_DIRECTORY = os.path.join(BIORXIV_DIRECTORY, 'articles')
-os.makedirs(ARTICLES_DIRECTORY, exist_ok=True)
+import metrics
+from biorxiv_01_download_days import DATE_FIELD, get_day_path
+from metrics import metrics_option, profile_option, record_run, stage
+from network import RateLimiter, get_session, rate_limit_option, retries_option, workers_option
+from storage import Store, backend_option
+from utils import (
+    BIORXIV_DIRECTORY, BIORXIV_METADATA_DIRECTORY, DAY, get_biorxiv_articles_store, get_biorxiv_journal,
+)
 
 ENDPOINT = 'https://api.biorxiv.org/details/biorxiv'
 
+#: The statuses of details responses that are worth keeping. Articles without details are kept so
+#: they're not asked for again.
+DETAILS_STATUSES = ('ok', 'no posts found')
+
+#: The maximum number of DOIs waiting to be downloaded, which keeps memory flat
+QUEUE_SIZE = 1000
+
+#: The number of versions on each page of a date range of details
+PAGE_SIZE = 100
+#: The number of days of details harvested at a time with ``--bulk``
+HARVEST_WINDOW_DAYS = 30
+#: The day that harvest windows are counted from, so they line up between runs
+HARVEST_EPOCH = datetime.date(2013, 11, 1)
+#: About how many versions each article has, for estimating how many pages a window of details takes
+VERSIONS_PER_ARTICLE = 1.5
+#: About how many requests for one article's details take as long as a page of versions, which has a hundred of them
+PAGE_COST = 4
+
+
+
+@click.command()
+@workers_option
+@rate_limit_option
+@retries_option
+@backend_option
+@click.option('--endpoint', default=ENDPOINT, show_default=True, help='The URL of the bioRxiv details API')
+@click.option(
+    '--bulk', is_flag=True,
+    help='Harvest the details by date range, only requesting articles on their own to fill in gaps',
+)
+@metrics_option
+@profile_option
+def main(
+    workers: int, rate_limit: Optional[float], retries: int, backend: str, endpoint: str, bulk: bool = False,
+    metrics_path: Optional[str] = None, profile_directory: Optional[str] = None,
+):
+    """Download the details for each article listed in the day files."""
+    with record_run(metrics_path, profile_directory), stage('biorxiv_articles'):
+        download_articles(
+            workers=workers, rate_limit=rate_limit, retries=retries, backend=backend, endpoint=endpoint, bulk=bulk,
+        )
+
+
+def download_articles(
+    *, workers: int, rate_limit: Optional[float], retries: int, backend: str, endpoint: str = ENDPOINT,
+    bulk: bool = False,
+) -> None:
+    """Download the details for each article listed in the day files, and journal the run."""
+    with get_biorxiv_journal().run('download_articles'):
+        _download_articles(
+            workers=workers, rate_limit=rate_limit, retries=retries, backend=backend, endpoint=endpoint, bulk=bulk,
+        )
+
+
+def _download_articles(
+    *, workers: int, rate_limit: Optional[float], retries: int, backend: str, endpoint: str, bulk: bool = False,
+) -> None:
+    """Download the details for each article listed in the day files that hasn't been downloaded yet.
+
+    Day files are read lazily by the main thread, which feeds a bounded queue
+    of DOIs that's drained by a pool of workers sharing one session.
+    """
+    session = get_session(pool_size=workers, retries=retries)
+    rate_limiter = RateLimiter(rate_limit)
+    dois: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
 
-def main():
-    for rpath, doi in _iter_rpaths():
-        url = f'{ENDPOINT}/{doi}'
-        response = requests.get(url)
-        response_json = response.json()
-        with open(rpath, 'w') as file:
-            json.dump(response_json, file, indent=2)
+    with get_biorxiv_articles_store(backend) as store:
+        if bulk:
+            listed: Counter = Counter()
+            posted = {
+                doi: _parse_day(entry.get('preprint_date')) for doi, entry in _iter_entries(store.keys(), listed)
+            }
+            missing: Iterable[str] = _harvest(
+                posted, listed, store=store, session=session, rate_limiter=rate_limiter, workers=workers,
+                endpoint=endpoint,
+            )
+        else:
+            missing = _iter_dois(store.keys())
+        it = tqdm(desc='Downloading article metadata', unit='article')
 
+        def _consume() -> None:
+            while True:
+                doi = dois.get()
+                if doi is None:
+                    return
+                try:
+                    _download_article(doi, store=store, session=session, rate_limiter=rate_limiter, endpoint=endpoint)
+                except Exception as e:
+                    # The article will be picked up again on the next run since nothing was written. Anything
+                    # is caught, since if the consumers stopped, the producer would block on the full queue.
+                    tqdm.write(f'Failed to download {doi}: {e}')
+                    metrics.inc('biorxiv_articles_total', result='failed')
+                else:
+                    metrics.inc('biorxiv_articles_total', result='fetched')
+                it.update()
 
-def _iter_rpaths() -> Iterable[Tuple[str, str]]:
-    paths = list(_iter_paths())
-    for path in tqdm(paths, desc='Downloading article metadata', unit='date'):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_consume) for _ in range(workers)]
+            try:
+                for doi in missing:
+                    dois.put(doi)
+            finally:
+                for _ in futures:
+                    dois.put(None)
+            for future in futures:
+                future.result()
+    it.close()
+
+
+def _get_key(doi: str) -> str:
+    return doi.replace("/", "_").strip()
+
+
+def _download_article(
+    doi: str, *, store: Store, session: requests.Session, rate_limiter: RateLimiter, endpoint: str = ENDPOINT,
+) -> None:
+    rate_limiter.acquire()
+    response = session.get(f'{endpoint.rstrip("/")}/{doi}')
+    response.raise_for_status()
+    record = response.json()
+    key = _get_key(doi)
+    problem = get_details_problem(key, record)
+    if problem is not None:
+        raise ValueError(f'got an error response: {problem}')
+    store.put(key, record)
+
+
+def get_details_problem(_key: str, record) -> Optional[str]:
+    """Get what's wrong with an article's details, like if they're an error response, or None if they look fine."""
+    if not isinstance(record, dict) or not isinstance(record.get('collection'), list):
+        return 'expected an object with a collection'
+    messages = record.get('messages') or [{}]
+    status = messages[0].get('status')
+    if status not in DETAILS_STATUSES:
+        return f'unexpected status {status!r}'
+    return None
+
+
+def _iter_dois(downloaded: Set[str]) -> Iterable[str]:
+    """Lazily iterate over the DOIs in the day files that haven't been downloaded yet.
+
+    The given set is updated in place since neighbouring day files overlap.
+    """
+    for doi, _entry in _iter_entries(downloaded):
+        yield doi
+
+
+def _iter_entries(downloaded: Set[str], listed: Optional[Counter] = None) -> Iterable[Tuple[str, Mapping]]:
+    """Lazily iterate over the DOIs and entries in the day files that haven't been downloaded yet.
+
+    :param listed: If given, every article in the day files, downloaded or not, is counted in it by the
+        first day of the harvest window it was first posted in
+    """
+    for path in _iter_paths():
         with open(path) as file:
             j = json.load(file)
-        for entry in tqdm(j, leave=False):
+        # Each article is in the day file of the day it's dated and of the day after, so it's counted in the
+        # first one, or in the second if the first wasn't downloaded
+        file_day = datetime.date.fromisoformat(os.path.basename(path)[:-len('.json')])
+        counted_days = {str(file_day)}
+        if not os.path.exists(get_day_path(file_day - DAY)):
+            counted_days.add(str(file_day - DAY))
+        for entry in j:
             doi = entry['biorxiv_doi']
-            rpath = os.path.join(ARTICLES_DIRECTORY, f'{doi.replace("/", "_").strip()}.json')
-            if os.path.exists(rpath):
+            if listed is not None and entry.get(DATE_FIELD) in counted_days:
+                day = _parse_day(entry.get('preprint_date'))
+                if day is not None:
+                    listed[_get_window_start(day)] += 1
+            key = _get_key(doi)
+            if key in downloaded:
+                metrics.inc('biorxiv_articles_total', result='skipped')
                 continue
-            yield rpath, doi
+            downloaded.add(key)
+            yield doi, entry
+
+
+class DetailsHarvest:
+    """The versions of the wanted articles from each window of days that's been harvested, kept in SQLite."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS versions (doi TEXT, version INTEGER, data TEXT, PRIMARY KEY (doi, version))'
+        )
+        self.connection.execute('CREATE TABLE IF NOT EXISTS windows (start TEXT PRIMARY KEY, end TEXT)')
+        self.connection.commit()
+
+    def get_windows(self) -> Set[Tuple[str, str]]:
+        """Get the start and end days of the windows that have been harvested."""
+        with self.lock:
+            return set(self.connection.execute('SELECT start, end FROM windows'))
+
+    def add_window(self, start: datetime.date, end: datetime.date, versions: Iterable[Mapping]) -> None:
+        """Add the versions from a window, all at once so a window is never partly harvested."""
+        rows = []
+        for version in versions:
+            try:
+                rows.append((version['doi'], int(version['version']), json.dumps(version)))
+            except (KeyError, TypeError, ValueError):
+                continue  # if it's the first version, the article gets requested on its own instead
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO versions VALUES (?, ?, ?)', rows)
+            self.connection.execute('INSERT OR REPLACE INTO windows VALUES (?, ?)', (str(start), str(end)))
+
+    def get_versions(self, doi: str) -> List[Mapping]:
+        """Get the harvested versions of an article, oldest first."""
+        with self.lock:
+            rows = self.connection.execute('SELECT data FROM versions WHERE doi = ? ORDER BY version', (doi,))
+            return [json.loads(data) for data, in rows]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+def get_harvest_path() -> str:
+    return os.path.join(BIORXIV_DIRECTORY, 'details_harvest.sqlite')
+
+
+def _get_window_start(day: datetime.date) -> datetime.date:
+    """Get the first day of the harvest window that a day is in."""
+    return HARVEST_EPOCH + (day - HARVEST_EPOCH).days // HARVEST_WINDOW_DAYS * HARVEST_WINDOW_DAYS * DAY
+
+
+def _get_windows(start: datetime.date, end: datetime.date) -> List[Tuple[datetime.date, datetime.date]]:
+    """Get the harvest windows that cover the days from start to end, newest first."""
+    first = _get_window_start(start)
+    windows = []
+    while first <= end:
+        windows.append((first, first + (HARVEST_WINDOW_DAYS - 1) * DAY))
+        first += HARVEST_WINDOW_DAYS * DAY
+    return windows[::-1]
+
+
+def _harvest(
+    posted: Mapping[str, Optional[datetime.date]], listed: Mapping[datetime.date, int], *, store: Store,
+    session: requests.Session, rate_limiter: RateLimiter, workers: int, endpoint: str = ENDPOINT,
+) -> List[str]:
+    """Harvest the details of the articles by date range where it pays off, and save the ones with a first version.
+
+    :param posted: The day each of the articles to get was first posted, by DOI, or None if it's unknown
+    :param listed: The number of articles in the day files first posted in each window, by its first day
+    :returns: The DOIs of the articles whose first version wasn't harvested, which should be requested on their own
+    """
+    if not posted:
+        return []
+    harvest = DetailsHarvest(get_harvest_path())
+    done = harvest.get_windows()
+    missing = Counter(_get_window_start(day) for day in posted.values() if day is not None)
+    start = min(missing, default=datetime.date.today())
+    all_windows = _choose_windows(
+        _get_windows(start, datetime.date.today()), missing=missing, listed=listed, done=done,
+    )
+    windows = [(first, last) for first, last in all_windows if (str(first), str(last)) not in done]
+    metrics.inc('biorxiv_harvest_windows_total', len(all_windows) - len(windows), result='skipped')
+    # Articles first posted before the oldest window are cheaper to request on their own
+    first_day = all_windows[-1][0] if all_windows else datetime.date.max
+    wanted = {doi for doi, day in posted.items() if day is not None and first_day <= day}
+
+    def _harvest_one(window: Tuple[datetime.date, datetime.date]) -> bool:
+        try:
+            versions = _get_versions(
+                *window, wanted=wanted, session=session, rate_limiter=rate_limiter, endpoint=endpoint,
+            )
+        except (requests.RequestException, ValueError) as e:
+            # The window is picked up again on the next run
+            tqdm.write(f'Failed to harvest {window[0]} to {window[1]}: {e}')
+            metrics.inc('biorxiv_harvest_windows_total', result='failed')
+            return False
+        harvest.add_window(*window, versions)
+        metrics.inc('biorxiv_harvest_windows_total', result='harvested')
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        harvested = list(tqdm(
+            executor.map(_harvest_one, windows), total=len(windows), desc='Harvesting article metadata', unit='window',
+        ))
+
+    # Articles first posted up to a window that failed could have later versions in it, so they're only
+    # complete once it's harvested on a later run. They're requested on their own for now.
+    failed = [first for (first, _last), ok in zip(windows, harvested) if not ok]
+    last_failed = max(failed, default=None)
+    gaps = [doi for doi in posted if doi not in wanted]
+    for doi in tqdm(wanted, desc='Saving harvested article metadata', unit='article'):
+        if last_failed is not None and _get_window_start(posted[doi]) <= last_failed:
+            gaps.append(doi)
+            continue
+        versions = harvest.get_versions(doi)
+        if not versions or int(versions[0]['version']) != 1:
+            gaps.append(doi)
+            continue
+        # Shaped like the response for the article on its own
+        store.put(_get_key(doi), {'messages': [{'status': 'ok'}], 'collection': versions})
+        metrics.inc('biorxiv_articles_total', result='harvested')
+    harvest.close()
+    if all(harvested):  # everything's saved, so there's nothing to pick up again
+        os.remove(harvest.path)
+    return gaps
+
+
+def _choose_windows(
+    windows: List[Tuple[datetime.date, datetime.date]], *, missing: Mapping[datetime.date, int],
+    listed: Mapping[datetime.date, int], done: Set[Tuple[str, str]],
+) -> List[Tuple[datetime.date, datetime.date]]:
+    """Choose which of the windows to harvest, newest first.
+
+    An article's later versions can be posted in any window after its first one, so they're only all
+    harvested if every window up to today is. The windows are harvested back from the newest one for as
+    long as that's estimated to take less time than requesting the missing articles in them on their own.
+
+    :param windows: The windows up to today, newest first
+    :param missing: The number of missing articles first posted in each window, by its first day
+    :param listed: The number of articles in the day files first posted in each window, by its first day.
+        Windows that no day file covers are assumed to be as busy as the average one that is.
+    :param done: The windows that have already been harvested, which are free
+    """
+    average = sum(listed.values()) / len(listed) if listed else 0
+    cost = best_cost = sum(missing.values())
+    best = 0
+    for i, (first, last) in enumerate(windows):
+        if (str(first), str(last)) not in done:
+            pages = math.ceil(listed.get(first, average) * VERSIONS_PER_ARTICLE / PAGE_SIZE)
+            cost += PAGE_COST * max(1, pages)
+        cost -= missing.get(first, 0)
+        if cost < best_cost:
+            best, best_cost = i + 1, cost
+    return windows[:best]
+
+
+def _get_versions(
+    start: datetime.date, end: datetime.date, *, wanted: Set[str], session: requests.Session,
+    rate_limiter: RateLimiter, endpoint: str = ENDPOINT,
+) -> List[Mapping]:
+    """Get all pages of versions posted from start to end, keeping the ones of the wanted articles."""
+    url = f'{endpoint.rstrip("/")}/{start}/{end}'
+    versions = []
+    cursor = 0
+    while True:
+        rate_limiter.acquire()
+        response = session.get(f'{url}/{cursor}')
+        response.raise_for_status()
+        j = response.json()
+        problem = get_details_problem(url, j)
+        if problem is not None:
+            raise ValueError(f'got an error response: {problem}')
+        collection = j['collection']
+        versions.extend(version for version in collection if version.get('doi') in wanted)
+        cursor += len(collection)
+        if len(collection) < PAGE_SIZE:
+            return versions
+
+
+def _parse_day(value) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
 
 
 def _iter_paths() -> Iterable[str]:
-    for year in range(2013, datetime.date.today().year):
+    for year in range(2013, datetime.date.today().year + 1):
         year_directory = os.path.join(BIORXIV_METADATA_DIRECTORY, str(year))
+        if not os.path.isdir(year_directory):
+            continue
         for month in os.listdir(year_directory):
             month_directory = os.path.join(year_directory, month)
             for name in os.listdir(month_directory):
@@ -1,50 +1,78 @@
-import json
-import os
+from typing import Any, Mapping, Optional
 
+import click
 import pandas as pd
-from gender_guesser.detector import Detector
 from tqdm import tqdm
 
-from biorxiv_02_download_articles import ARTICLES_DIRECTORY, BIORXIV_DIRECTORY
-
-
-def main():
-    detector = Detector(case_sensitive=False)
-    rows = []
-    for name in tqdm(os.listdir(ARTICLES_DIRECTORY)):
-        if not name.endswith('.json'):
-            continue
-        with open(os.path.join(ARTICLES_DIRECTORY, name)) as file:
-            j = json.load(file)
-
-        collection = j['collection']
-        if not collection:
-            tqdm.write(f'Empty collection for {name}')
-            continue
-        i = collection[0]
-        authors = i['authors'].split(';')
-        rows.append(dict(
-            id=i['doi'],
-            title=i['title'],
-            first_author_name=authors[0],
-            first_author_inferred_gender=fix_name(authors[0], detector),
-            license=i['license'],
-            category=i['category'].strip(),
-            posted=i['date'],
-            peer_reviewed=i['published'],
-        ))
-
-    df = pd.DataFrame(rows).sort_values('posted')
-    df.to_csv(os.path.join(BIORXIV_DIRECTORY, 'articles.tsv'), sep='\t', index=False)
+from metrics import metrics_option, profile_option, record_run, stage
+from storage import backend_option
+from summary import build_summary, read_summary
+from utils import BIORXIV_SUMMARY_PATH, batch_size_option, get_biorxiv_articles_store, incremental_option, jobs_option
+
+
+@click.command()
+@backend_option
+@incremental_option
+@jobs_option
+@batch_size_option
+@metrics_option
+@profile_option
+def main(
+    backend: str, incremental: bool, jobs: int, batch_size: Optional[int], metrics_path: Optional[str],
+    profile_directory: Optional[str],
+):
+    with record_run(metrics_path, profile_directory), stage('summarize'):
+        process(backend=backend, incremental=incremental, jobs=jobs, batch_size=batch_size)
+
+
+def process(*, backend: str, incremental: bool = False, jobs: int = 1, batch_size: Optional[int] = None) -> None:
+    """Summarize the article details in ``articles.tsv``, then report how many genders were inferred."""
+    with get_biorxiv_articles_store(backend) as store:
+        df = build_summary(
+            store,
+            BIORXIV_SUMMARY_PATH,
+            get_row=get_row,
+            get_first_names=get_first_names,
+            sort_by='posted',
+            incremental=incremental,
+            jobs=jobs,
+            batch_size=batch_size,
+        )
+    if df is None:  # built in batches, so only load what's needed
+        df = read_summary(BIORXIV_SUMMARY_PATH, columns=[])
+        if len(df.index):
+            df = read_summary(BIORXIV_SUMMARY_PATH, columns=['first_author_inferred_gender'])
+    if not len(df.index):  # an empty summary doesn't have the gender column
+        tqdm.write('No articles to assign genders to')
+        return
 
     i = (df['first_author_inferred_gender'] != 'unknown').sum()
     tqdm.write(f'Authors with assigned genders: {i}/{len(df.index)} ({i / len(df.index):.2%})')
 
 
-def fix_name(s, detector):
-    if ',' in s:
-        return 'unknown'
-    return detector.get_gender(s.split(' ')[0])
+def get_row(name: str, j: Mapping[str, Any]) -> Optional[Mapping[str, Any]]:
+    """Get a summary row for a bioRxiv details record, or None if it's empty."""
+    collection = j['collection']
+    if not collection:
+        tqdm.write(f'Empty collection for {name}')
+        return None
+    i = collection[0]
+    authors = i['authors'].split(';')
+    return dict(
+        id=i['doi'],
+        title=i['title'],
+        first_author_name=authors[0],
+        license=i['license'],
+        category=i['category'].strip(),
+        posted=i['date'],
+        peer_reviewed=i['published'],
+        authors=[(author.strip(), None) for author in authors],
+    )
+
+
+def get_first_names(names: pd.Series) -> pd.Series:
+    """Get the first name from each author name, unless it's written last name first."""
+    return names.str.split(' ').str[0].where(~names.str.contains(',', regex=False))
 
 
 if __name__ == '__main__':
@@ -1,25 +1,74 @@
-import os
+import time
+from typing import Optional, Sequence
 
+import click
 import pandas as pd
 
-from biorxiv_02_download_articles import BIORXIV_DIRECTORY
-from utils import plot_cumulative_licenses, plot_gender_evolution, plot_gender_male_percentage, plot_papers_by_month
+from aggregates import MonthlyAggregates, get_aggregates
+from metrics import metrics_option, profile_option, record_run, stage
+from plots import plot_cumulative_licenses, plot_gender_evolution, plot_gender_male_percentage, plot_papers_by_month
+from rendering import (
+    clear_render_cache, dpi_option, force_option, formats_option, render_charts, render_workers_option,
+)
+from summary import read_summary
+from utils import BIORXIV_DIRECTORY, BIORXIV_SUMMARY_PATH
 
+#: The columns that get aggregated for the charts
+COLUMNS = ['id', 'time', 'license', 'first_author_inferred_gender', 'category']
 
-def get_df():
-    df = pd.read_csv(os.path.join(BIORXIV_DIRECTORY, 'articles.tsv'), sep='\t')
-    df['year'] = df['posted'].map(lambda x: int(x.split('-')[0]))
-    df['month'] = df['posted'].map(lambda x: int(x.split('-')[1]))
-    df['time'] = [f'{a - 2000}-{b:02}' for a, b in df[['year', 'month']].values]
-    return df
 
+def get_df(columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    return read_summary(BIORXIV_SUMMARY_PATH, columns=columns)
 
-def main():
-    df = get_df()
-    plot_papers_by_month(df, BIORXIV_DIRECTORY, 'biorxiv', figsize=(14, 6))
-    plot_cumulative_licenses(df, BIORXIV_DIRECTORY, 'biorxiv', figsize=(14, 6))
-    plot_gender_male_percentage(df, BIORXIV_DIRECTORY, 'biorxiv', figsize=(14, 6))
-    plot_gender_evolution(df, BIORXIV_DIRECTORY, 'biorxiv', figsize=(14, 6))
+
+PLOTS = [
+    plot_papers_by_month,
+    plot_cumulative_licenses,
+    plot_gender_male_percentage,
+    plot_gender_evolution,
+]
+
+
+@click.command()
+@render_workers_option
+@formats_option
+@dpi_option
+@force_option
+@metrics_option
+@profile_option
+def main(
+    workers: int, formats: Sequence[str], dpi: int, force: bool, metrics_path: Optional[str],
+    profile_directory: Optional[str],
+):
+    with record_run(metrics_path, profile_directory):
+        with stage('aggregate'):
+            aggregates = aggregate()
+        with stage('render'):
+            render(aggregates, workers=workers, formats=formats, dpi=dpi, force=force)
+
+
+def aggregate() -> MonthlyAggregates:
+    """Get the monthly aggregates of the summary, only loading it if it changed."""
+    return get_aggregates(BIORXIV_SUMMARY_PATH, load=lambda: get_df(columns=COLUMNS))
+
+
+def render(aggregates: MonthlyAggregates, *, workers: int, formats: Sequence[str], dpi: int, force: bool) -> None:
+    """Render each chart whose data changed, or all of them if forced."""
+    if force:
+        clear_render_cache(BIORXIV_DIRECTORY)
+
+    start = time.perf_counter()
+    charts = [
+        (plot, dict(
+            aggregates=aggregates,
+            directory=BIORXIV_DIRECTORY,
+            institution_name='biorxiv',
+            figsize=(14, 6),
+        ))
+        for plot in PLOTS
+    ]
+    render_charts(charts, workers=workers, formats=formats, dpi=dpi)
+    click.echo(f'Rendered {len(charts)} charts in {time.perf_counter() - start:.2f}s')
 
 
 if __name__ == '__main__':
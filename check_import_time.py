@@ -0,0 +1,61 @@
+"""Check that the download scripts start quickly.
+
+Each crawler is imported in a fresh interpreter with ``python -X importtime``. This fails
+if importing it takes longer than the budget, or if it pulls in any of the processing or
+plotting libraries, which are only needed by later stages. Run it with
+``python check_import_time.py``.
+"""
+
+import subprocess
+import sys
+from typing import Dict, Sequence
+
+import click
+
+from utils import HERE
+
+#: The scripts that should start quickly, since they're run from cron and short-lived containers
+CRAWLERS = ('01_download', 'biorxiv_01_download_days', 'biorxiv_02_download_articles')
+
+#: Libraries that the crawlers shouldn't import
+FORBIDDEN = ('pandas', 'numpy', 'matplotlib', 'seaborn', 'gender_guesser', 'pyarrow')
+
+
+def get_import_times(module: str) -> Dict[str, int]:
+    """Import a module in a fresh interpreter and get the cumulative microseconds spent importing each module."""
+    # __import__ rather than importlib.import_module since only the former is timed
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'__import__({module!r})'],
+        cwd=HERE, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@click.command()
+@click.option('--budget', type=float, default=0.5, show_default=True, help='Seconds each crawler may take to import')
+@click.argument('modules', nargs=-1)
+def main(budget: float, modules: Sequence[str]):
+    """Check that importing each crawler (or the given MODULES) is fast and doesn't load the plotting stack."""
+    failed = False
+    for module in modules or CRAWLERS:
+        times = get_import_times(module)
+        seconds = times[module] / 1e6
+        forbidden = sorted(name for name in FORBIDDEN if name in times)
+        ok = seconds <= budget and not forbidden
+        failed = failed or not ok
+        message = f'{"ok" if ok else "FAIL":<4} {module:<30} {seconds:.3f}s'
+        if forbidden:
+            message += f' imports {", ".join(forbidden)}'
+        click.echo(message)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""A client for the Figshare API, which hosted ChemRxiv.
+
+Processing dependencies like :mod:`pandas` are only imported by the methods that need them,
+and :mod:`requests` only once the first request is sent.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Iterable, Mapping, Optional, Sequence
+
+import click
+from tqdm import tqdm
+
+import metrics
+from journal import Journal
+from network import RateLimiter, get_session
+from storage import Store, get_store, write_json
+from utils import FIGSHARE_DIRECTORY
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import requests
+
+token_option = click.option('--token')
+
+
+class FigshareClient:
+    """Handle FigShare API requests, using an access token.
+
+    Adapted from https://github.com/fxcoudert/tools/blob/master/chemRxiv/chemRxiv.py.
+
+    The institution is looked up the first time it's needed and is remembered in
+    ``figshare/institutions.json``, so commands that only work with downloaded data
+    don't need the network.
+    """
+
+    base = 'https://api.figshare.com/v2'
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        page_size: Optional[int] = None,
+        workers: Optional[int] = None,
+        rate_limit: Optional[float] = None,
+        backend: str = 'directory',
+        retries: int = 5,
+        base: Optional[str] = None,
+    ):
+        if token is None:
+            with open(os.path.expanduser('~/.config/figshare/chemrxiv.txt'), 'r') as file:
+                token = file.read().strip()
+
+        if base is not None:
+            self.base = base.rstrip('/')
+        self.page_size = page_size or 500
+        self.token = token
+        self.headers = {'Authorization': f'token {self.token}'}
+        self.workers = workers or 1
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.retries = retries
+        self._session: Optional['requests.Session'] = None
+        self.backend = backend
+        self._institution_details: Optional[Mapping[str, Any]] = None
+
+    @property
+    def session(self) -> 'requests.Session':
+        """Get the session, making it the first time it's needed."""
+        if self._session is None:
+            self._session = get_session(pool_size=max(10, self.workers), retries=self.retries)
+            self._session.headers.update(self.headers)
+        return self._session
+
+    @property
+    def institution_details(self) -> Mapping[str, Any]:
+        """Get the ``id`` and ``name`` of the token's institution."""
+        if self._institution_details is None:
+            self._institution_details = self._get_institution_details()
+        return self._institution_details
+
+    def _get_institution_details(self) -> Mapping[str, Any]:
+        path = os.path.join(FIGSHARE_DIRECTORY, 'institutions.json')
+        # Don't keep the token itself around in plain text
+        token_hash = hashlib.sha256(self.token.encode('utf-8')).hexdigest()[:16]
+        institutions = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                institutions = json.load(file)
+        if token_hash not in institutions:
+            #: Got from https://docs.figshare.com/#private_institution_details
+            institution_details = self.query('account/institution')
+            institutions[token_hash] = {key: institution_details[key] for key in ('id', 'name')}
+            os.makedirs(FIGSHARE_DIRECTORY, exist_ok=True)
+            write_json(path, institutions, indent=2)
+        return institutions[token_hash]
+
+    @property
+    def institution(self) -> int:
+        return self.institution_details['id']
+
+    @property
+    def institution_name(self) -> str:
+        return self.institution_details['name']
+
+    @property
+    def institution_directory(self) -> str:
+        return os.path.join(FIGSHARE_DIRECTORY, self.institution_name.lower())
+
+    @property
+    def articles_short_directory(self) -> str:
+        return os.path.join(self.institution_directory, 'articles_short')
+
+    @property
+    def articles_long_directory(self) -> str:
+        return os.path.join(self.institution_directory, 'articles_long')
+
+    @classmethod
+    def get_institution_name(cls, token=None) -> str:
+        return cls(token=token).institution_name
+
+    def request(self, url, *, params=None, headers=None):
+        """Send a FigShare API request."""
+        self.rate_limiter.acquire()
+        return self.session.get(url, params=params, headers=headers)
+
+    def query(self, query, *, params=None):
+        """Perform a direct query."""
+        r = self.request(f'{self.base}/{query.lstrip("/")}', params=params)
+        r.raise_for_status()
+        return r.json()
+
+    def query_generator(self, query, params=None):
+        """Query for a list of items, with paging. Returns a generator."""
+        if params is None:
+            params = {}
+
+        page = 1
+        while True:
+            params.update({'page_size': self.page_size, 'page': page})
+            r = self.request(f'{self.base}/{query}', params=params)
+            if r.status_code == 400:
+                raise ValueError(r.json()['message'])
+            r.raise_for_status()
+            r = r.json()
+
+            # Special case if a single item, not a list, was returned
+            if not isinstance(r, list):
+                yield r
+                return
+
+            # If we have no more results, bail out
+            if len(r) == 0:
+                return
+
+            yield from r
+            page += 1
+
+    def all_preprints(self, modified_since: Optional[str] = None):
+        """Return a generator to all the chemRxiv articles_short.
+
+        :param modified_since: If given, only list articles modified on or after this ``YYYY-MM-DD`` date
+
+        .. seealso:: https://docs.figshare.com/#articles_list
+        """
+        params = {'institution': self.institution}
+        if modified_since is not None:
+            params.update({'modified_since': modified_since, 'order': 'modified_date', 'order_direction': 'asc'})
+        return self.query_generator('articles', params=params)
+
+    def preprint(self, article_id):
+        """Information on a given preprint.
+
+        .. seealso:: https://docs.figshare.com/#public_article
+        """
+        return self.query(f'articles/{article_id}')
+
+    def get_short_store(self) -> Store:
+        """Get the store for the records from the institution's article listing."""
+        return get_store(self.articles_short_directory, self.backend)
+
+    def get_long_store(self) -> Store:
+        """Get the store for the full article records."""
+        return get_store(self.articles_long_directory, self.backend)
+
+    @property
+    def journal(self) -> Journal:
+        """Get the journal of the institution's crawls."""
+        return Journal(os.path.join(self.institution_directory, 'journal.jsonl'))
+
+    @property
+    def sync_path(self) -> str:
+        return os.path.join(self.institution_directory, 'articles_short_sync.json')
+
+    def get_sync_state(self) -> Mapping[str, Any]:
+        """Get the day the listing was last synced and the ids whose full records are out of date."""
+        if not os.path.exists(self.sync_path):
+            return {'modified_since': None, 'stale': []}
+        with open(self.sync_path) as file:
+            return json.load(file)
+
+    def _write_sync_state(self, modified_since: Optional[str], stale: Iterable[str]) -> None:
+        write_json(self.sync_path, {'modified_since': modified_since, 'stale': sorted(stale, key=int)}, indent=2)
+
+    def download_short(self, sync: bool = False) -> None:
+        """Download the institution's article listing.
+
+        :param sync: If true and the listing was synced before, only list the articles modified
+            since the day of the last sync. These are overwritten and marked so :meth:`download_full`
+            fetches them again. The first sync lists everything, like without syncing.
+        """
+        state = self.get_sync_state()
+        modified_since = state['modified_since'] if sync else None
+        # The date filter has day resolution, so starting from the day of the last sync overlaps a little
+        today = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+        stale = set(state['stale'])
+        with self.journal.run('download_short', sync=sync), self.get_short_store() as store:
+            done = store.keys()
+            for preprint in tqdm(self.all_preprints(modified_since), desc='Getting all articles_short'):
+                key = str(preprint['id'])
+                if key in done:
+                    if modified_since is None:
+                        metrics.inc('figshare_listing_total', result='skipped')
+                        continue
+                    stale.add(key)
+                    metrics.inc('figshare_listing_total', result='changed')
+                else:
+                    metrics.inc('figshare_listing_total', result='new')
+                store.put(key, preprint)
+        if sync:
+            self._write_sync_state(today, stale)
+
+    def download_full(self, refresh: bool = False) -> None:
+        """Download the full record for each short record, using :attr:`workers` concurrent requests.
+
+        Records marked as changed by :meth:`download_short` are also fetched again.
+
+        :param refresh: If true, records that were already downloaded are fetched again with a
+            conditional request, so they're only transferred if they changed on the server
+        """
+        with self.journal.run('download_full', refresh=refresh):
+            self._download_full(refresh=refresh)
+
+    def _download_full(self, refresh: bool) -> None:
+        validators_path = os.path.join(self.institution_directory, 'articles_long_validators.json')
+        validators = {}
+        if os.path.exists(validators_path):
+            with open(validators_path) as file:
+                validators = json.load(file)
+        validators_lock = threading.Lock()
+        sync_state = self.get_sync_state()
+        stale = set(sync_state['stale'])
+
+        with self.get_short_store() as short_store, self.get_long_store() as long_store:
+            listed = short_store.keys()
+            keys = listed if refresh else (listed - long_store.keys()) | (listed & stale)
+            metrics.inc('figshare_articles_total', len(listed) - len(keys), result='skipped')
+            preprint_ids = sorted(int(key) for key in keys)
+
+            def _download_full_one(preprint_id: int) -> None:
+                key = str(preprint_id)
+                validator = validators.get(key, {}) if key in long_store else {}
+                headers = {}
+                if 'etag' in validator:
+                    headers['If-None-Match'] = validator['etag']
+                if 'last_modified' in validator:
+                    headers['If-Modified-Since'] = validator['last_modified']
+                r = self.request(f'{self.base}/articles/{preprint_id}', headers=headers)
+                if r.status_code == 304:  # not modified since the last download
+                    metrics.inc('figshare_articles_total', result='not_modified')
+                    with validators_lock:
+                        stale.discard(key)
+                    return
+                r.raise_for_status()
+                record = r.json()
+                problem = get_record_problem(key, record)
+                if problem is not None:
+                    raise ValueError(f'Got an invalid record for {preprint_id}: {problem}')
+                long_store.put(key, record)
+                metrics.inc('figshare_articles_total', result='fetched')
+                validator = {}
+                if 'ETag' in r.headers:
+                    validator['etag'] = r.headers['ETag']
+                if 'Last-Modified' in r.headers:
+                    validator['last_modified'] = r.headers['Last-Modified']
+                with validators_lock:
+                    validators[key] = validator
+                    stale.discard(key)
+
+            try:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    for _ in tqdm(executor.map(_download_full_one, preprint_ids), total=len(preprint_ids)):
+                        pass
+            finally:
+                write_json(validators_path, validators)
+                if sync_state['stale']:
+                    self._write_sync_state(sync_state['modified_since'], stale)
+
+    def process_articles(
+        self, incremental: bool = False, jobs: int = 1, batch_size: Optional[int] = None,
+    ) -> Optional['pd.DataFrame']:
+        """Summarize the full article records in ``articles_summary.tsv``."""
+        from summary import build_summary, get_figshare_first_names, get_figshare_row
+
+        with self.get_long_store() as store:
+            return build_summary(
+                store,
+                os.path.join(self.institution_directory, 'articles_summary.tsv'),
+                get_row=get_figshare_row,
+                get_first_names=get_figshare_first_names,
+                sort_by='id',
+                incremental=incremental,
+                jobs=jobs,
+                batch_size=batch_size,
+            )
+
+    def get_df(self, columns: Optional[Sequence[str]] = None) -> 'pd.DataFrame':
+        from summary import get_df
+
+        return get_df(self.institution_directory, columns=columns)
+
+
+def get_record_problem(key: str, record) -> Optional[str]:
+    """Get what's wrong with a short or full article record, or None if it looks fine."""
+    if not isinstance(record, dict):
+        return f'expected an object, got {type(record).__name__}'
+    if str(record.get('id')) != key:
+        return f'expected the id {key}, got {record.get("id")!r}'
+    return None
@@ -0,0 +1,80 @@
+"""Infer genders from first names with :mod:`gender_guesser`, remembering each name's result.
+
+First names repeat a lot between articles, so each distinct name is only looked
+up once and the results are broadcast back over the column. The results are also
+kept in ``gender_cache.json``, which is shared by the ChemRxiv and bioRxiv
+pipelines, so a name is only ever looked up once and the (slow to build)
+:class:`gender_guesser.detector.Detector` is only built when there's a new name.
+
+Possible gender determination alternatives:
+
+- https://gender-api.com/ (reference from https://twitter.com/AdamSci12/status/1323977415677382656)
+- https://genderize.io/
+"""
+
+import json
+import os
+import threading
+from importlib.metadata import version
+from typing import Dict, Optional
+
+import pandas as pd
+from gender_guesser.detector import Detector
+
+from storage import write_json
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+GENDER_CACHE_PATH = os.path.join(HERE, 'gender_cache.json')
+
+UNKNOWN = 'unknown'
+
+#: Caches are saved one at a time, since :mod:`pipeline` summarizes the sources in parallel threads
+_SAVE_LOCK = threading.Lock()
+
+
+class GenderCache:
+    """A name to gender mapping that's filled in by a case-insensitive detector."""
+
+    def __init__(self, path: Optional[str] = GENDER_CACHE_PATH):
+        self.path = path
+        self.version = version('gender_guesser')
+        self.genders: Dict[str, str] = {}
+        self.changed = False
+        self._detector: Optional[Detector] = None
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path) as file:
+                j = json.load(file)
+            # Results from a different version of the name dictionary might not hold anymore
+            if j['version'] == self.version:
+                self.genders = j['genders']
+
+    @property
+    def detector(self) -> Detector:
+        """Get the detector, building it the first time it's needed."""
+        if self._detector is None:
+            self._detector = Detector(case_sensitive=False)
+        return self._detector
+
+    def infer(self, first_names: pd.Series) -> pd.Series:
+        """Infer the gender for each first name. Missing names are unknown."""
+        keys = first_names.str.lower()
+        for key in keys.dropna().unique():
+            if key not in self.genders:
+                self.genders[key] = self.detector.get_gender(key)
+                self.changed = True
+        return keys.map(self.genders).fillna(UNKNOWN)
+
+    def save(self) -> None:
+        """Write the cache if any new names were looked up."""
+        if self.path is None or not self.changed:
+            return
+        with _SAVE_LOCK:
+            # Keep the names saved by other runs since this one read the cache, like the other source's
+            if os.path.exists(self.path):
+                with open(self.path) as file:
+                    j = json.load(file)
+                if j['version'] == self.version:
+                    self.genders = {**j['genders'], **self.genders}
+            # Write then rename so a concurrent run never reads a half-written cache
+            write_json(self.path, {'version': self.version, 'genders': self.genders}, sort_keys=True)
+        self.changed = False
@@ -0,0 +1,67 @@
+"""Generate a synthetic corpus of Figshare- or bioRxiv-shaped article records.
+
+The records come from the same generators as :mod:`mock_api`, so they parse like
+downloaded ones. Use the ``sqlite`` backend for big corpora, like
+``python generate_corpus.py corpus --source biorxiv --size 1000000 --backend sqlite``.
+"""
+
+import datetime
+import os
+from typing import Iterable, Mapping, Tuple
+
+import click
+from tqdm import tqdm
+
+from mock_api import get_biorxiv_details, get_biorxiv_dois, get_figshare_article
+from storage import Store, backend_option, get_store
+
+SOURCES = ('figshare', 'biorxiv')
+
+#: The first day of the synthetic bioRxiv articles
+BIORXIV_FIRST_DAY = datetime.date(2014, 1, 1)
+#: The number of days the synthetic bioRxiv articles are spread over
+BIORXIV_DAYS = 2500
+
+
+def get_corpus_store(directory: str, source: str, backend: str = 'directory') -> Store:
+    """Get the store for a corpus, laid out like the source's downloaded full records."""
+    name = 'articles_long' if source == 'figshare' else 'articles'
+    return get_store(os.path.join(directory, name), backend)
+
+
+def iter_records(source: str, size: int) -> Iterable[Tuple[str, Mapping]]:
+    """Iterate over the keys and records of a synthetic corpus. They're the same for every call."""
+    if source == 'figshare':
+        for article_id in range(1, size + 1):
+            yield str(article_id), get_figshare_article(article_id)
+        return
+
+    articles_per_day = -(-size // BIORXIV_DAYS)  # round up so there are enough days
+    remaining = size
+    day = BIORXIV_FIRST_DAY
+    while remaining > 0:
+        for doi in get_biorxiv_dois(day, min(articles_per_day, remaining)):
+            yield doi.replace('/', '_'), get_biorxiv_details(doi)
+        remaining -= articles_per_day
+        day += datetime.timedelta(days=1)
+
+
+def generate_corpus(directory: str, source: str, size: int, backend: str = 'directory') -> None:
+    """Write a synthetic corpus of the given size into a directory."""
+    with get_corpus_store(directory, source, backend) as store:
+        for key, record in tqdm(iter_records(source, size), total=size, desc=f'Generating {source} corpus'):
+            store.put(key, record)
+
+
+@click.command()
+@click.argument('directory', type=click.Path(file_okay=False, dir_okay=True))
+@click.option('--source', type=click.Choice(SOURCES), default='figshare', show_default=True)
+@click.option('--size', type=int, default=10_000, show_default=True, help='Number of articles, like 10000 or 1000000')
+@backend_option
+def main(directory: str, source: str, size: int, backend: str):
+    """Generate a synthetic corpus of articles in DIRECTORY."""
+    generate_corpus(directory, source, size, backend)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""An append-only journal of crawler runs, like ``biorxiv/journal.jsonl``.
+
+Each crawler adds a ``start`` entry when it begins and a ``finish`` entry with its status
+when it ends, even if it fails or is interrupted. A run that has a start but no finish was
+killed, so whatever it was writing should be checked with ``python verify.py``, which adds a
+``verify`` entry with the records it queued to be downloaded again.
+
+Entries are single JSON lines appended to the file, so a line cut off by a crash only loses
+that entry, and it's skipped when reading.
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+
+class Journal:
+    """Append entries about runs to a JSON lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def append(self, event: str, **fields: Any) -> None:
+        """Add an entry for an event, with the current time."""
+        entry = dict(event=event, time=datetime.datetime.now(datetime.timezone.utc).isoformat(), **fields)
+        line = (json.dumps(entry, default=str) + '\n').encode('utf-8')
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a+b') as file:
+                if file.seek(0, os.SEEK_END):
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b'\n':  # the last entry was cut off, so don't add to it
+                        line = b'\n' + line
+                file.write(line)
+
+    def read(self) -> List[Dict[str, Any]]:
+        """Get all entries, skipping any line that was cut off."""
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
+
+    @contextmanager
+    def run(self, command: str, **fields: Any) -> Iterator[str]:
+        """Add a start entry, then a finish entry whose status is ``ok``, ``failed``, or ``interrupted``.
+
+        :returns: The run's identifier, which is on both entries
+        """
+        run = uuid.uuid4().hex[:12]
+        self.append('start', run=run, command=command, pid=os.getpid(), **fields)
+        start = time.perf_counter()
+        status, error = 'ok', None
+        try:
+            yield run
+        except KeyboardInterrupt:
+            status = 'interrupted'
+            raise
+        except BaseException as e:
+            status, error = 'failed', repr(e)
+            raise
+        finally:
+            self.append('finish', run=run, status=status, error=error, seconds=time.perf_counter() - start)
+
+    def get_unfinished_runs(self) -> List[Dict[str, Any]]:
+        """Get the start entries of runs that never finished, since the last verification."""
+        started = {}
+        for entry in self.read():
+            if entry['event'] == 'start':
+                started[entry['run']] = entry
+            elif entry['event'] == 'finish':
+                started.pop(entry['run'], None)
+            elif entry['event'] == 'verify':
+                started.clear()
+        return list(started.values())
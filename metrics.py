@@ -0,0 +1,271 @@
+"""Counters, latency histograms, and stage timers for seeing where a run spends its time.
+
+Code anywhere in a run records into a shared registry with :func:`inc`, :func:`observe`,
+:func:`timer`, and :func:`stage`. The scripts take ``--metrics run.json``, which writes
+everything at the end of the run as JSON and in the Prometheus text format next to it, like
+``run.prom``, and ``--profile profiles``, which dumps a :mod:`cProfile` of each stage into
+that directory, like ``profiles/summarize.prof``.
+
+Comparing the ``stage_seconds`` with the ``http_request_seconds`` and ``parse_seconds``
+histograms shows whether a slow run is waiting on the network, parsing, or rendering.
+Only :mod:`click` and the standard library are imported, so the crawlers stay quick to start.
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import click
+
+if TYPE_CHECKING:
+    import cProfile
+
+metrics_option = click.option(
+    '--metrics', 'metrics_path', type=click.Path(dir_okay=False),
+    help='Write the run\'s metrics as JSON to this file, and in the Prometheus text format next to it',
+)
+profile_option = click.option(
+    '--profile', 'profile_directory', type=click.Path(file_okay=False, dir_okay=True),
+    help='Dump a cProfile of each stage of the run into this directory',
+)
+
+#: The upper bounds of the histogram buckets, in seconds
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _get_key(name: str, labels: Mapping[str, Any]) -> Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class Histogram:
+    """Counts of observations in each bucket, along with their sum."""
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is for everything bigger
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        i = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative_counts(self) -> List[Tuple[str, int]]:
+        """Get the number of observations up to each bucket's upper bound, ending with ``+Inf``."""
+        bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+        total = 0
+        rv = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            rv.append((bound, total))
+        return rv
+
+    def get_quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return None
+        return next(
+            float(bound) for bound, count in self.get_cumulative_counts() if count >= q * self.count
+        )
+
+
+class Metrics:
+    """A thread-safe registry of counters, histograms, and stage timings."""
+
+    def __init__(self, profile_directory: Optional[str] = None):
+        self.profile_directory = profile_directory
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.counters: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        #: The total seconds spent in each stage
+        self.stages: Dict[str, float] = {}
+        self.profiles: Dict[str, 'cProfile.Profile'] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Add to a counter, like ``inc('http_requests_total', status=200)``."""
+        key = _get_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Add an observation, like a latency in seconds, to a histogram."""
+        key = _get_key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Observe how many seconds the context takes in a histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a stage of the run, and profile it if there's a profile directory.
+
+        A profile only covers the thread that runs the stage, so for the download stages, whose
+        requests are sent from worker threads, look at the ``http_*`` metrics instead. Stages
+        inside other stages are timed but not profiled separately.
+        """
+        profile = None
+        if self.profile_directory is not None and not getattr(self._local, 'profiling', False):
+            import cProfile
+
+            with self._lock:
+                profile = self.profiles.setdefault(name, cProfile.Profile())
+            try:
+                profile.enable()
+            except ValueError:  # another profiler is already running, like in another thread on Python 3.12+
+                profile = None
+            else:
+                self._local.profiling = True
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                self._local.profiling = False
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def to_json(self) -> Dict[str, Any]:
+        """Get the metrics as a JSON-serializable dictionary."""
+        with self._lock:
+            return dict(
+                started=self.started.isoformat(),
+                seconds=(datetime.datetime.now(datetime.timezone.utc) - self.started).total_seconds(),
+                stages=dict(self.stages),
+                counters=[
+                    dict(name=name, labels=dict(labels), value=value)
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                histograms=[
+                    dict(
+                        name=name,
+                        labels=dict(labels),
+                        count=histogram.count,
+                        sum=histogram.sum,
+                        p50=histogram.get_quantile(0.5),
+                        p95=histogram.get_quantile(0.95),
+                        buckets=dict(histogram.get_cumulative_counts()),
+                    )
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ],
+            )
+
+    def to_prometheus(self) -> str:
+        """Get the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, samples in _group(self.counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                lines.extend(f'{name}{_format_labels(labels)} {value}' for labels, value in samples)
+            for name, samples in _group(self.histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in samples:
+                    for bound, count in histogram.get_cumulative_counts():
+                        lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+            if self.stages:
+                lines.append('# TYPE stage_seconds gauge')
+                lines.extend(
+                    f'stage_seconds{_format_labels((("stage", name),))} {seconds}'
+                    for name, seconds in sorted(self.stages.items())
+                )
+        return ''.join(f'{line}\n' for line in lines)
+
+    def write(self, path: str) -> None:
+        """Write the metrics as JSON to the path and in the Prometheus text format next to it."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(self.to_json(), file, indent=2)
+        with open(f'{os.path.splitext(path)[0]}.prom', 'w') as file:
+            file.write(self.to_prometheus())
+
+    def dump_profiles(self) -> None:
+        """Write the profile of each stage, if there's a profile directory."""
+        if self.profile_directory is None or not self.profiles:
+            return
+        os.makedirs(self.profile_directory, exist_ok=True)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(self.profile_directory, f'{name}.prof'))
+
+
+def _group(items) -> Iterator[Tuple[str, List[tuple]]]:
+    groups: Dict[str, List[tuple]] = {}
+    for (name, labels), value in sorted(items, key=lambda item: item[0]):
+        groups.setdefault(name, []).append((labels, value))
+    return iter(groups.items())
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (label, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in labels
+    )
+    return '{' + ','.join(f'{label}="{value}"' for label, value in escaped) + '}'
+
+
+#: The registry that everything records into
+REGISTRY = Metrics()
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Add to a counter in the shared registry."""
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Add an observation to a histogram in the shared registry."""
+    REGISTRY.observe(name, value, **labels)
+
+
+def timer(name: str, **labels):
+    """Observe how many seconds the context takes in a histogram in the shared registry."""
+    return REGISTRY.timer(name, **labels)
+
+
+def stage(name: str):
+    """Time, and maybe profile, a stage of the run in the shared registry."""
+    return REGISTRY.stage(name)
+
+
+@contextmanager
+def record_run(path: Optional[str] = None, profile_directory: Optional[str] = None) -> Iterator[Metrics]:
+    """Start a fresh shared registry, then write its metrics and profiles when the run ends, even if it fails.
+
+    :param path: The JSON file to write the metrics to, with the Prometheus version next to it
+    :param profile_directory: The directory to dump a profile of each stage into
+    """
+    global REGISTRY
+    REGISTRY = Metrics(profile_directory=profile_directory)
+    try:
+        yield REGISTRY
+    finally:
+        if path is not None:
+            REGISTRY.write(path)
+        REGISTRY.dump_profiles()
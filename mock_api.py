@@ -0,0 +1,331 @@
+"""A local stand-in for the Figshare and bioRxiv APIs, so the crawlers can be measured offline.
+
+Responses are generated from each record's identifier, so they're the same on every run
+and nothing needs to be recorded first. Latency, errors, and the number of records (and so
+the number of pages) can be configured. Run it with ``python mock_api.py --port 8000`` then
+point the crawlers at it, like:
+
+- ``python 01_download.py --token x --base http://localhost:8000/v2``
+- ``python biorxiv_01_download_days.py --endpoint http://localhost:8000/pub``
+- ``python biorxiv_02_download_articles.py --endpoint http://localhost:8000/details/biorxiv``
+
+The supported endpoints are:
+
+- ``/v2/account/institution``
+- ``/v2/articles`` with ``page``, ``page_size`` and ``modified_since`` parameters
+- ``/v2/articles/<id>``, which also answers conditional requests
+- ``/pub/<start>/<end>/<cursor>``
+- ``/details/biorxiv/<doi>``
+- ``/details/biorxiv/<start>/<end>/<cursor>``
+"""
+
+import datetime
+import json
+import random
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import click
+
+#: The number of records on each page of the bioRxiv API
+BIORXIV_PAGE_SIZE = 100
+#: The most days after the first version of a bioRxiv article that a second one can be posted
+BIORXIV_REVISION_DAYS = 60
+
+INSTITUTION = {'id': 259, 'name': 'ChemRxiv'}
+FIRST_DAY = datetime.date(2017, 8, 1)
+
+FIRST_NAMES = [
+    'Alice', 'Bob', 'Carlos', 'Dmitri', 'Emma', 'Fatima', 'Guo', 'Hannah', 'Ivan', 'Julia', 'Kenji', 'Laura',
+    'Mohammed', 'Nina', 'Olga', 'Pedro', 'Qing', 'Rachel', 'Sanjay', 'Tom', 'Ute', 'Victor', 'Wei', 'Yuki',
+]
+LAST_NAMES = ['Smith', 'Müller', 'Wang', 'Garcia', 'Kumar', 'Ivanova', 'Tanaka', 'Silva', 'Cohen', 'Novak']
+LICENSES = ['CC BY 4.0', 'CC BY-NC 4.0', 'CC BY-NC-ND 4.0', 'CC0']
+CATEGORIES = ['neuroscience', 'microbiology', 'bioinformatics', 'genomics', 'cell biology', 'ecology']
+
+
+def _get_name(rng: random.Random) -> str:
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def _get_orcid(author_id: int) -> str:
+    return '0000-000{}-{:04}-{:04}'.format(1 + author_id % 3, author_id // 10000 % 10000, author_id % 10000)
+
+
+def get_figshare_posted(article_id: int) -> datetime.date:
+    """Get the day a synthetic Figshare article was posted, which is also when it was last modified."""
+    return FIRST_DAY + datetime.timedelta(days=random.Random(article_id).randint(0, 3 * 365))
+
+
+def get_figshare_short(article_id: int) -> Mapping[str, Any]:
+    """Get a synthetic record like the ones in the Figshare article listing."""
+    posted = get_figshare_posted(article_id)
+    return {
+        'id': article_id,
+        'title': f'Article {article_id}',
+        'doi': f'10.26434/chemrxiv.{article_id}.v1',
+        'url': f'https://api.figshare.com/v2/articles/{article_id}',
+        'published_date': f'{posted}T00:00:00Z',
+        'defined_type': 12,
+        'defined_type_name': 'preprint',
+    }
+
+
+def get_figshare_article(article_id: int) -> Mapping[str, Any]:
+    """Get a synthetic full Figshare article record."""
+    rng = random.Random(article_id)
+    posted = get_figshare_posted(article_id)
+    return {
+        **get_figshare_short(article_id),
+        'description': ' '.join(rng.choice(LAST_NAMES).lower() for _ in range(rng.randint(50, 200))),
+        'timeline': {'posted': f'{posted}T00:00:00', 'firstOnline': f'{posted}T00:00:00'},
+        'license': {'value': 1, 'name': rng.choice(LICENSES), 'url': 'https://creativecommons.org/'},
+        'authors': [{'id': i, 'full_name': _get_name(rng)} for i in range(rng.randint(1, 8))],
+        # Authors come back, so each submitter is picked from the ones that could have submitted before
+        'custom_fields': [
+            {'name': 'ORCID For Submitting Author', 'value': _get_orcid(rng.randint(0, article_id // 3))},
+        ],
+        'modified_date': f'{posted}T00:00:00Z',
+    }
+
+
+def get_biorxiv_dois(day: datetime.date, articles_per_day: int) -> List[str]:
+    """Get the DOIs of the synthetic bioRxiv articles published on the given day."""
+    return [f'10.1101/{day:%Y.%m.%d}.{i:06}' for i in range(articles_per_day)]
+
+
+def get_biorxiv_pub(doi: str, day: datetime.date) -> Mapping[str, Any]:
+    """Get a synthetic record like the ones from the bioRxiv publication API."""
+    return {
+        'biorxiv_doi': doi,
+        'published_doi': f'10.1000/journal.{doi.rsplit(".", 1)[1]}',
+        'published_journal': 'Journal of Synthetic Results',
+        'preprint_date': str(day),
+        'published_date': str(day),
+    }
+
+
+def get_biorxiv_details(doi: str) -> Mapping[str, Any]:
+    """Get a synthetic record like the ones from the bioRxiv details API, with a version of the article per entry."""
+    rng = random.Random(doi)
+    day = datetime.datetime.strptime(doi.split('/')[1][:10], '%Y.%m.%d').date()
+    versions = [{
+        'doi': doi,
+        'title': f'Article {doi}',
+        'authors': '; '.join(
+            f'{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)[0]}.' if rng.random() < 0.2 else _get_name(rng)
+            for _ in range(rng.randint(1, 8))
+        ),
+        'author_corresponding': _get_name(rng),
+        'date': str(day),
+        'version': '1',
+        'license': rng.choice(['cc_by', 'cc_by_nc', 'cc_no']),
+        'category': rng.choice(CATEGORIES),
+        'abstract': ' '.join(rng.choice(LAST_NAMES).lower() for _ in range(rng.randint(50, 200))),
+        'published': rng.choice(['NA', f'10.1000/journal.{rng.randint(0, 99999)}']),
+        'server': 'biorxiv',
+    }]
+    if rng.random() < 0.3:
+        revised = day + datetime.timedelta(days=rng.randint(1, BIORXIV_REVISION_DAYS))
+        versions.append({**versions[0], 'date': str(revised), 'version': '2'})
+    return {'messages': [{'status': 'ok'}], 'collection': versions}
+
+
+@lru_cache(maxsize=16)
+def get_biorxiv_versions(start: str, end: str, articles_per_day: int) -> List[Mapping[str, Any]]:
+    """Get every version of the synthetic bioRxiv articles posted between two days, oldest first.
+
+    It's cached since it's the same for each page of a date range.
+    """
+    start_day, end_day = datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+    records = []
+    day = start_day - datetime.timedelta(days=BIORXIV_REVISION_DAYS)
+    while day <= end_day:
+        for doi in get_biorxiv_dois(day, articles_per_day):
+            records.extend(
+                version
+                for version in get_biorxiv_details(doi)['collection']
+                if start <= version['date'] <= end
+            )
+        day += datetime.timedelta(days=1)
+    return sorted(records, key=lambda version: (version['date'], version['doi'], version['version']))
+
+
+class MockAPI:
+    """The configuration and statistics of a mock API server."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        figshare_articles: int = 1000,
+        articles_per_day: int = 20,
+        seed: int = 0,
+    ):
+        #: The number of seconds each response is delayed by
+        self.latency = latency
+        #: The fraction of requests answered with a 503 that says to retry right away
+        self.error_rate = error_rate
+        #: The number of articles in the Figshare institution
+        self.figshare_articles = figshare_articles
+        #: The number of bioRxiv articles published each day
+        self.articles_per_day = articles_per_day
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = self.errors = self.not_modified = self.bytes = 0
+
+    def reset_stats(self) -> Dict[str, int]:
+        """Get the number of requests, errors, not modified responses, and bytes sent, then zero them."""
+        with self.lock:
+            stats = dict(
+                requests=self.requests, errors=self.errors, not_modified=self.not_modified, bytes=self.bytes,
+            )
+            self.requests = self.errors = self.not_modified = self.bytes = 0
+        return stats
+
+    def serve(self, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+        """Start serving in a background thread. Use ``server.server_port`` if the port was picked automatically."""
+        server = ThreadingHTTPServer((host, port), _Handler)
+        server.daemon_threads = True
+        server.api = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def handle(self, path: str, params: Mapping[str, List[str]]) -> Tuple[int, Optional[Any]]:
+        """Get the status and JSON body for a request."""
+        parts = path.strip('/').split('/')
+        if parts[:3] == ['v2', 'account', 'institution']:
+            return 200, INSTITUTION
+        if parts == ['v2', 'articles']:
+            return 200, self._list_figshare(params)
+        if parts[:2] == ['v2', 'articles'] and len(parts) == 3 and parts[2].isdigit():
+            article_id = int(parts[2])
+            if not 1 <= article_id <= self.figshare_articles:
+                return 404, {'message': 'Entity not found: article', 'code': 'EntityNotFound'}
+            return 200, get_figshare_article(article_id)
+        if parts[0] == 'pub' and len(parts) in {3, 4}:
+            return 200, self._list_biorxiv(parts[1], parts[2], int(parts[3]) if len(parts) == 4 else 0)
+        if parts[:2] == ['details', 'biorxiv'] and len(parts) == 4 and parts[2].startswith('10.'):
+            return 200, get_biorxiv_details('/'.join(parts[2:]))
+        if parts[:2] == ['details', 'biorxiv'] and len(parts) in {4, 5}:
+            return 200, self._list_biorxiv_details(parts[2], parts[3], int(parts[4]) if len(parts) == 5 else 0)
+        return 404, {'message': f'unknown endpoint: {path}'}
+
+    def _list_figshare(self, params: Mapping[str, List[str]]) -> List[Mapping[str, Any]]:
+        page = int(params.get('page', ['1'])[0])
+        page_size = int(params.get('page_size', ['10'])[0])
+        article_ids = range(1, self.figshare_articles + 1)
+        if 'modified_since' in params:
+            since = datetime.date.fromisoformat(params['modified_since'][0])
+            article_ids = sorted(
+                (i for i in article_ids if since <= get_figshare_posted(i)),
+                key=get_figshare_posted,
+            )
+        return [get_figshare_short(i) for i in article_ids[(page - 1) * page_size:page * page_size]]
+
+    def _list_biorxiv(self, start: str, end: str, cursor: int) -> Mapping[str, Any]:
+        start_day, end_day = datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+        records = []
+        day = start_day
+        while day <= end_day:
+            records.extend(get_biorxiv_pub(doi, day) for doi in get_biorxiv_dois(day, self.articles_per_day))
+            day += datetime.timedelta(days=1)
+        page = records[cursor:cursor + BIORXIV_PAGE_SIZE]
+        if not page:
+            return {'messages': [{'status': 'no articles found'}], 'collection': []}
+        return {
+            'messages': [{'status': 'ok', 'interval': f'{start}/{end}', 'cursor': cursor, 'count': len(page),
+                          'total': len(records)}],
+            'collection': page,
+        }
+
+    def _list_biorxiv_details(self, start: str, end: str, cursor: int) -> Mapping[str, Any]:
+        records = get_biorxiv_versions(start, end, self.articles_per_day)
+        page = records[cursor:cursor + BIORXIV_PAGE_SIZE]
+        if not page:
+            return {'messages': [{'status': 'no posts found'}], 'collection': []}
+        return {
+            'messages': [{'status': 'ok', 'interval': f'{start}/{end}', 'cursor': cursor, 'count': len(page),
+                          'total': len(records)}],
+            'collection': page,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections alive, like the real APIs
+    # The headers and body are written separately, which Nagle's algorithm would hold back for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        api: MockAPI = self.server.api
+        if api.latency:
+            time.sleep(api.latency)
+        with api.lock:
+            api.requests += 1
+            failed = api.random.random() < api.error_rate
+            if failed:
+                api.errors += 1
+        if failed:
+            self._send(503, b'{"message": "try again"}', {'Retry-After': '0'})
+            return
+
+        url = urlparse(self.path)
+        status, j = api.handle(url.path, parse_qs(url.query))
+        body = json.dumps(j).encode('utf-8')
+        etag = f'"{zlib.crc32(body):08x}"'
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            with api.lock:
+                api.not_modified += 1
+            self._send(304, b'', {'ETag': etag})
+            return
+        self._send(status, body, {'ETag': etag} if status == 200 else {})
+
+    def _send(self, status: int, body: bytes, headers: Mapping[str, str]) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.api.lock:
+            self.server.api.bytes += len(body)
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', type=int, default=8000, show_default=True)
+@click.option('--latency', type=float, default=0.0, show_default=True, help='Seconds to delay each response by')
+@click.option('--error-rate', type=float, default=0.0, show_default=True, help='Fraction of requests that get a 503')
+@click.option('--figshare-articles', type=int, default=1000, show_default=True)
+@click.option('--articles-per-day', type=int, default=20, show_default=True, help='bioRxiv articles per day')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed for which requests fail')
+def main(
+    host: str, port: int, latency: float, error_rate: float, figshare_articles: int, articles_per_day: int, seed: int,
+):
+    """Serve mock Figshare and bioRxiv APIs until interrupted."""
+    api = MockAPI(
+        latency=latency, error_rate=error_rate, figshare_articles=figshare_articles,
+        articles_per_day=articles_per_day, seed=seed,
+    )
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.api = api
+    click.echo(f'Serving on http://{host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        click.echo(f'Served {api.reset_stats()}')
+
+
+if __name__ == '__main__':
+    main()
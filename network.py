@@ -0,0 +1,96 @@
+"""Shared code for talking to web APIs politely.
+
+:mod:`requests` is only imported once a session is made, so importing this is cheap.
+"""
+
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+import click
+
+import metrics
+
+if TYPE_CHECKING:
+    import requests
+
+workers_option = click.option('--workers', type=int, default=1, show_default=True, help='Number of concurrent requests')
+rate_limit_option = click.option('--rate-limit', type=float, help='Maximum requests per second')
+retries_option = click.option(
+    '--retries', type=int, default=5, show_default=True,
+    help='Number of times a request is retried after a connection error, 429, or 5xx response',
+)
+
+
+class RateLimiter:
+    """A thread-safe token bucket that caps how many requests are sent per second."""
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or (max(1, int(rate)) if rate else 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available. Does nothing if no rate was given."""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve a token even if it's not there yet, so concurrent callers queue up behind each other
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            metrics.inc('rate_limit_wait_seconds_total', wait)
+            time.sleep(wait)
+
+
+#: Statuses worth retrying since they're usually transient
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def get_session(pool_size: int = 10, retries: int = 5, backoff_factor: float = 1.0) -> 'requests.Session':
+    """Get a session whose connections are kept alive and shared between threads.
+
+    :param pool_size: The number of connections kept alive per host
+    :param retries: The number of times a request is retried after a connection error or
+        one of :data:`RETRY_STATUSES`. The wait between retries grows exponentially, unless the
+        response says how long to wait with its ``Retry-After`` header.
+    :param backoff_factor: The wait before the first retry, in seconds
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({'GET'}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.hooks['response'].append(_record_response)
+    return session
+
+
+def _record_response(response: 'requests.Response', *_args, **_kwargs) -> None:
+    """Record a response's status, size, retries, and latency in the metrics.
+
+    The latency includes the retries and reading the body, which is read here rather than after the hook.
+    """
+    start = time.perf_counter() - response.elapsed.total_seconds()
+    size = len(response.content)
+    metrics.observe('http_request_seconds', time.perf_counter() - start)
+    metrics.inc('http_requests_total', status=response.status_code)
+    metrics.inc('http_response_bytes_total', size)
+    retries = getattr(response.raw, 'retries', None)
+    if retries is not None and retries.history:
+        metrics.inc('http_retries_total', len(retries.history))
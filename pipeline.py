@@ -0,0 +1,447 @@
+"""Run the download, process, aggregate, and render stages of each source, skipping the ones that are up to date.
+
+Each source is a chain of stages that does what its numbered scripts do when they're run by hand:
+
+- ``figshare``: ``listing`` → ``articles`` → ``process`` → ``aggregate`` → ``render``
+- ``biorxiv``: ``days`` → ``articles`` → ``process`` → ``aggregate`` → ``render``
+
+Every stage but the downloads is fingerprinted by what it reads (the records in a store, a
+summary's files, the code that makes its outputs, and options like ``--formats``) and by what it
+writes. A stage is skipped when both are the same as the last time it finished, which is kept in
+``pipeline_state.json``. Downloads always run, since what they read is remote, unless ``--offline``
+is given, so a nightly ``python pipeline.py --sync --incremental`` only summarizes and charts a
+source again when its download brought something new. A stage starts as soon as the stages it
+depends on are done, so the sources are run concurrently, and a stage that fails only stops the
+ones that depend on it.
+"""
+
+import datetime
+import hashlib
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence
+
+import click
+
+import metrics
+from aggregates import get_aggregates_path
+from authors import get_author_paths
+from figshare_client import FigshareClient, token_option
+from metrics import metrics_option, profile_option, record_run
+from network import rate_limit_option, retries_option, workers_option
+from rendering import dpi_option, formats_option, get_chart_paths
+from storage import backend_option, get_store, has_store, write_json
+from utils import (
+    BIORXIV_ARTICLES_DIRECTORY, BIORXIV_SUMMARY_PATH, HERE, batch_size_option, incremental_option, jobs_option,
+)
+
+#: Where the fingerprints from the last time each stage finished are kept
+STATE_PATH = os.path.join(HERE, 'pipeline_state.json')
+
+SOURCES = ('figshare', 'biorxiv')
+
+#: The base URL of the bioRxiv publication and details APIs
+BIORXIV_BASE = 'https://api.biorxiv.org'
+
+#: A function that lists what a stage reads or writes, as the JSON-serializable parts of its fingerprint
+Fingerprinter = Callable[[], List[Any]]
+
+
+class Stage:
+    """A step of a source's pipeline, the stages it waits for, and how to tell if it's up to date."""
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[], Any],
+        *,
+        dependencies: Sequence[str] = (),
+        inputs: Optional[Fingerprinter] = None,
+        outputs: Optional[Fingerprinter] = None,
+    ):
+        #: The stage's name, like ``biorxiv_process``, which is also its name in the metrics
+        self.name = name
+        self.run = run
+        self.dependencies = tuple(dependencies)
+        #: Lists what the stage reads. If None, like for downloads, it can't be checked so the stage always runs.
+        self.inputs = inputs
+        #: Lists what the stage writes, so it runs again if they were changed or removed since it last finished
+        self.outputs = outputs
+
+
+def get_fingerprint(parts: Sequence[Any]) -> str:
+    """Hash the parts of a fingerprint."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def fingerprint_files(*paths: str) -> List[Any]:
+    """Get the size and modification time of each file, or None for the ones that don't exist."""
+    rv = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            rv.append([os.path.relpath(path, HERE), None])
+        else:
+            rv.append([os.path.relpath(path, HERE), stat.st_size, stat.st_mtime_ns])
+    return rv
+
+
+def fingerprint_store(directory: str, backend: str) -> List[Any]:
+    """Hash the version of each record in a store, which changes when any record is added, changed, or removed."""
+    if not has_store(directory, backend):
+        return [os.path.relpath(directory, HERE), backend, None]
+    with get_store(directory, backend) as store:
+        versions = store.versions()
+    return [os.path.relpath(directory, HERE), backend, get_fingerprint(sorted(versions.items()))]
+
+
+def fingerprint_code(*modules: str) -> List[Any]:
+    """Hash the source of the modules, so a stage runs again when the code that makes its outputs changes."""
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(os.path.join(HERE, f'{module}.py'), 'rb') as file:
+            digest.update(file.read())
+    return [list(modules), digest.hexdigest()]
+
+
+def get_summary_paths(path: str) -> List[str]:
+    """Get the paths of the files written by a process step: the summary's TSV, Parquet, manifest, and authors."""
+    stem = os.path.splitext(path)[0]
+    return [path, f'{stem}.parquet', f'{stem}.manifest.json', *get_author_paths(path)]
+
+
+class Pipeline:
+    """Run stages as soon as the ones they depend on are done, skipping the ones that are up to date."""
+
+    def __init__(self, stages: Sequence[Stage], state_path: str = STATE_PATH, force: bool = False):
+        """Check the stages and load what happened the last time each one finished.
+
+        :param stages: The stages to run. Each has to come after the ones it depends on.
+        :param state_path: The JSON file where the fingerprints from each stage's last run are kept
+        :param force: If true, every stage runs even if it's up to date
+        """
+        self.stages = {}
+        for stage in stages:
+            missing = [name for name in stage.dependencies if name not in self.stages]
+            if missing:
+                raise ValueError(f'{stage.name} depends on stages that do not come before it: {missing}')
+            self.stages[stage.name] = stage
+        self.state_path = state_path
+        self.force = force
+        self.state: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(state_path):
+            with open(state_path) as file:
+                self.state = json.load(file)
+        self.lock = threading.Lock()
+
+    def run(self) -> Dict[str, str]:
+        """Run every stage, concurrently when they don't depend on each other.
+
+        :returns: What happened to each stage: ``ran``, ``skipped`` if it was up to date,
+            ``failed``, or ``blocked`` if a stage it depends on failed
+        """
+        results: Dict[str, str] = {}
+        pending = list(self.stages.values())
+        with ThreadPoolExecutor(max_workers=len(pending) or 1) as executor:
+            running = {}
+            while pending or running:
+                for stage in list(pending):
+                    statuses = [results.get(name) for name in stage.dependencies]
+                    if any(status in ('failed', 'blocked') for status in statuses):
+                        results[stage.name] = 'blocked'
+                    elif all(status in ('ran', 'skipped') for status in statuses):
+                        running[executor.submit(self._run_stage, stage)] = stage.name
+                    else:
+                        continue
+                    pending.remove(stage)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception:
+                        click.echo(f'{name} failed\n{traceback.format_exc()}', err=True)
+                        results[name] = 'failed'
+        for result in results.values():
+            metrics.inc('pipeline_stages_total', result=result)
+        return results
+
+    def _run_stage(self, stage: Stage) -> str:
+        with self.lock:
+            previous = self.state.get(stage.name)
+        inputs = None if stage.inputs is None else get_fingerprint(stage.inputs())
+        if (
+            not self.force
+            and inputs is not None
+            and previous is not None
+            and previous['inputs'] == inputs
+            and previous['outputs'] == self._get_outputs(stage)
+        ):
+            click.echo(f'Skipped {stage.name}, it is up to date')
+            return 'skipped'
+
+        click.echo(f'Running {stage.name}')
+        start = time.perf_counter()
+        with metrics.stage(stage.name):
+            stage.run()
+        seconds = time.perf_counter() - start
+        entry = dict(
+            inputs=inputs,
+            outputs=self._get_outputs(stage),
+            finished=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            seconds=seconds,
+        )
+        with self.lock:
+            self.state[stage.name] = entry
+            write_json(self.state_path, self.state, indent=2, sort_keys=True)
+        click.echo(f'Finished {stage.name} in {seconds:.2f}s')
+        return 'ran'
+
+    @staticmethod
+    def _get_outputs(stage: Stage) -> Optional[str]:
+        return None if stage.outputs is None else get_fingerprint(stage.outputs())
+
+
+def get_summary_stages(
+    source: str,
+    *,
+    process: Callable[[], Any],
+    aggregate: Callable[[], Any],
+    render: Callable[[], Any],
+    get_store_directory: Callable[[], str],
+    get_summary_path: Callable[[], str],
+    backend: str,
+    process_code: Sequence[str],
+    render_options: Mapping[str, Any],
+    dependencies: Sequence[str] = (),
+) -> List[Stage]:
+    """Get the stages that summarize a source's records, aggregate the summary, and render the charts.
+
+    :param source: The source's name, which the stage names start with
+    :param process: Summarizes the records
+    :param aggregate: Builds and caches the aggregates of the summary
+    :param render: Renders the charts from the cached aggregates
+    :param get_store_directory: Gets the directory of the records' store
+    :param get_summary_path: Gets the path of the summary's TSV file, whose directory the charts are saved in
+    :param backend: How the records are stored
+    :param process_code: The modules that summarize the records, besides :mod:`summary` and the ones it uses
+    :param render_options: The options that change how the charts look, which have to include the ``formats``
+    :param dependencies: The stages that the summary waits for, like the downloads
+    """
+    return [
+        Stage(
+            f'{source}_process',
+            process,
+            dependencies=dependencies,
+            inputs=lambda: [
+                fingerprint_store(get_store_directory(), backend),
+                fingerprint_code('summary', 'gender', 'authors', *process_code),
+            ],
+            outputs=lambda: fingerprint_files(*get_summary_paths(get_summary_path())),
+        ),
+        Stage(
+            f'{source}_aggregate',
+            aggregate,
+            dependencies=[f'{source}_process'],
+            inputs=lambda: [
+                fingerprint_files(*get_summary_paths(get_summary_path())[:2]),
+                fingerprint_code('aggregates'),
+            ],
+            outputs=lambda: fingerprint_files(get_aggregates_path(get_summary_path())),
+        ),
+        Stage(
+            f'{source}_render',
+            render,
+            dependencies=[f'{source}_aggregate'],
+            inputs=lambda: [
+                fingerprint_files(get_aggregates_path(get_summary_path())),
+                fingerprint_code('plots', 'rendering'),
+                render_options,
+            ],
+            outputs=lambda: fingerprint_files(
+                *get_chart_paths(os.path.dirname(get_summary_path()), render_options['formats']),
+            ),
+        ),
+    ]
+
+
+def get_figshare_stages(
+    get_client: Callable[[], FigshareClient],
+    *,
+    backend: str,
+    offline: bool,
+    sync: bool,
+    refresh: bool,
+    process_options: Mapping[str, Any],
+    render_options: Mapping[str, Any],
+    render_workers: int,
+    force: bool,
+) -> List[Stage]:
+    """Get the stages that download, summarize, and chart the articles of a Figshare institution."""
+    def _render() -> None:
+        visualize = importlib.import_module('03_visualize')
+        visualize.render(
+            get_client(), visualize.aggregate(get_client()), workers=render_workers, force=force, **render_options,
+        )
+
+    stages = []
+    if not offline:
+        stages.append(Stage('figshare_listing', lambda: get_client().download_short(sync=sync)))
+        stages.append(Stage(
+            'figshare_articles', lambda: get_client().download_full(refresh=refresh), dependencies=['figshare_listing'],
+        ))
+    stages.extend(get_summary_stages(
+        'figshare',
+        process=lambda: get_client().process_articles(**process_options),
+        aggregate=lambda: importlib.import_module('03_visualize').aggregate(get_client()),
+        render=_render,
+        get_store_directory=lambda: get_client().articles_long_directory,
+        get_summary_path=lambda: os.path.join(get_client().institution_directory, 'articles_summary.tsv'),
+        backend=backend,
+        process_code=['figshare_client'],
+        render_options=render_options,
+        dependencies=[stage.name for stage in stages[-1:]],
+    ))
+    return stages
+
+
+def get_biorxiv_stages(
+    *,
+    backend: str,
+    offline: bool,
+    workers: int,
+    rate_limit: float,
+    retries: int,
+    adaptive: bool,
+    bulk: bool,
+    base: str,
+    process_options: Mapping[str, Any],
+    render_options: Mapping[str, Any],
+    render_workers: int,
+    force: bool,
+) -> List[Stage]:
+    """Get the stages that download, summarize, and chart the bioRxiv articles."""
+    def _download_days() -> None:
+        from biorxiv_01_download_days import download_days
+
+        download_days(
+            None, None, workers=workers, rate_limit=rate_limit, retries=retries, endpoint=f'{base}/pub',
+            adaptive=adaptive,
+        )
+
+    def _download_articles() -> None:
+        from biorxiv_02_download_articles import download_articles
+
+        download_articles(
+            workers=workers, rate_limit=rate_limit, retries=retries, backend=backend,
+            endpoint=f'{base}/details/biorxiv', bulk=bulk,
+        )
+
+    def _render() -> None:
+        visualize = importlib.import_module('biorxiv_04_visualize')
+        visualize.render(visualize.aggregate(), workers=render_workers, force=force, **render_options)
+
+    stages = []
+    if not offline:
+        stages.append(Stage('biorxiv_days', _download_days))
+        stages.append(Stage('biorxiv_articles', _download_articles, dependencies=['biorxiv_days']))
+    stages.extend(get_summary_stages(
+        'biorxiv',
+        process=lambda: importlib.import_module('biorxiv_03_process').process(backend=backend, **process_options),
+        aggregate=lambda: importlib.import_module('biorxiv_04_visualize').aggregate(),
+        render=_render,
+        get_store_directory=lambda: BIORXIV_ARTICLES_DIRECTORY,
+        get_summary_path=lambda: BIORXIV_SUMMARY_PATH,
+        backend=backend,
+        process_code=['biorxiv_03_process'],
+        render_options=render_options,
+        dependencies=[stage.name for stage in stages[-1:]],
+    ))
+    return stages
+
+
+@click.command()
+@click.option(
+    '--source', 'sources', type=click.Choice(SOURCES), multiple=True,
+    help='Only run the stages of these sources. Defaults to all of them',
+)
+@click.option(
+    '--offline', is_flag=True, help='Skip the downloads, and only update what is stale from the records on disk',
+)
+@click.option('--force', is_flag=True, help='Run every stage and render every chart, even if they are up to date')
+@click.option(
+    '--state', 'state_path', type=click.Path(dir_okay=False), default=STATE_PATH, show_default=True,
+    help='The file that keeps the fingerprints from the last time each stage finished',
+)
+@token_option
+@backend_option
+@workers_option
+@rate_limit_option
+@retries_option
+@click.option('--sync', is_flag=True, help='Only list the Figshare articles modified since the last sync')
+@click.option('--refresh', is_flag=True, help='Re-check already downloaded Figshare articles')
+@click.option('--adaptive', is_flag=True, help='Request the bioRxiv day files in multi-day windows')
+@click.option('--bulk', is_flag=True, help='Harvest the bioRxiv details by date range')
+@click.option('--base', default=FigshareClient.base, show_default=True, help='The base URL of the Figshare API')
+@click.option(
+    '--biorxiv-base', default=BIORXIV_BASE, show_default=True, help='The base URL of the bioRxiv APIs',
+)
+@incremental_option
+@jobs_option
+@batch_size_option
+@click.option(
+    '--render-workers', type=int, default=1, show_default=True, help='Number of charts rendered in parallel',
+)
+@formats_option
+@dpi_option
+@metrics_option
+@profile_option
+def main(
+    sources: Sequence[str], offline: bool, force: bool, state_path: str, token: Optional[str], backend: str,
+    workers: int, rate_limit: float, retries: int, sync: bool, refresh: bool, adaptive: bool, bulk: bool, base: str,
+    biorxiv_base: str, incremental: bool, jobs: int, batch_size: Optional[int], render_workers: int,
+    formats: Sequence[str], dpi: int, metrics_path: Optional[str], profile_directory: Optional[str],
+):
+    """Download, summarize, and chart each source, only running the stages whose inputs changed."""
+    options = dict(
+        backend=backend,
+        offline=offline,
+        process_options=dict(incremental=incremental, jobs=jobs, batch_size=batch_size),
+        render_options=dict(formats=tuple(formats), dpi=dpi),
+        render_workers=render_workers,
+        force=force,
+    )
+    stages = []
+    if 'figshare' in (sources or SOURCES):
+        # The client is made when it's first needed, so a missing token only fails the Figshare stages
+        get_client = lru_cache(maxsize=None)(partial(
+            FigshareClient, token=token, workers=workers, rate_limit=rate_limit, backend=backend, retries=retries,
+            base=base,
+        ))
+        stages.extend(get_figshare_stages(get_client, sync=sync, refresh=refresh, **options))
+    if 'biorxiv' in (sources or SOURCES):
+        stages.extend(get_biorxiv_stages(
+            workers=workers, rate_limit=rate_limit, retries=retries, adaptive=adaptive, bulk=bulk, base=biorxiv_base,
+            **options,
+        ))
+
+    with record_run(metrics_path, profile_directory):
+        results = Pipeline(stages, state_path=state_path, force=force).run()
+    for name, result in results.items():
+        click.echo(f'{result:<8} {name}')
+    if any(result in ('failed', 'blocked') for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""Draw the charts from the monthly aggregates."""
+
+import os
+from typing import Sequence
+
+import pandas as pd
+import seaborn as sns
+from matplotlib import pyplot as plt
+
+from aggregates import MonthlyAggregates
+from rendering import get_stale_render_key, write_render_key
+from summary import get_current_time
+
+
+def get_gender_counts(aggregates: MonthlyAggregates, assign_andy: bool = False) -> pd.DataFrame:
+    """Get the number of articles for each month and inferred gender, excluding the current month.
+
+    Mostly male and mostly female names are counted as male and female.
+
+    :param aggregates: The monthly aggregates
+    :param assign_andy: If true, androgynous names are assigned a gender. Historically, they've all been
+        assigned as male unless there's only one article.
+    """
+    counts = aggregates.genders.rename_axis(columns='first_author_inferred_gender').stack()
+    current_time = get_current_time()
+    counts = counts[(0 < counts) & (counts.index.get_level_values('time') != current_time)]
+
+    genders = counts.index.get_level_values('first_author_inferred_gender').astype(str)
+    genders = genders.map(lambda gender: GENDER_GROUPS.get(gender, gender))
+    if assign_andy:
+        articles = aggregates.articles.drop(current_time, errors='ignore').sum()
+        genders = genders.map(lambda gender: gender if gender != 'andy' else 'male' if articles // 2 else 'female')
+
+    return (
+        counts
+        .groupby([counts.index.get_level_values('time'), genders.rename('first_author_inferred_gender')])
+        .sum()
+        .reset_index(name='id')
+    )
+
+
+#: Inferred genders that are counted with another
+GENDER_GROUPS = {
+    'mostly_male': 'male',
+    'mostly_female': 'female',
+}
+
+
+def _savefig(fig, directory: str, name: str, key: str, formats: Sequence[str] = ('png',), dpi: int = 300) -> None:
+    """Save the figure in each format.
+
+    The callers close the figure in a ``finally`` block, so memory doesn't grow with each chart even if one fails.
+    """
+    for extension in formats:
+        fig.savefig(os.path.join(directory, f'{name}.{extension}'), dpi=dpi)
+    write_render_key(directory, name, key)
+
+
+def plot_papers_by_month(aggregates, directory, institution_name, figsize=(10, 6), formats=('png',), dpi=300):
+    # How many papers each month?
+    articles_by_month = aggregates.articles.reset_index(name='id')
+    key = get_stale_render_key(
+        directory, 'articles_per_month', articles_by_month, institution_name, figsize, formats, dpi,
+    )
+    if key is None:
+        return False
+    fig = plt.figure(figsize=figsize)
+    try:
+        sns.barplot(data=articles_by_month, x='time', y='id')
+        plt.title(f'{institution_name} Articles per Month')
+        plt.xlabel('Month')
+        plt.ylabel('Articles')
+        plt.xticks(rotation=45)
+        plt.tight_layout()
+        _savefig(fig, directory, 'articles_per_month', key, formats=formats, dpi=dpi)
+    finally:
+        plt.close(fig)
+    return True
+
+
+def plot_unique_authors_per_month(aggregates, directory, institution_name, figsize=(10, 6), formats=('png',), dpi=300):
+    # How many unique first authors each month?
+    unique_authors_per_month = aggregates.unique_authors.reset_index(name='id')
+    key = get_stale_render_key(
+        directory, 'unique_authors_per_month', unique_authors_per_month, institution_name, figsize, formats, dpi,
+    )
+    if key is None:
+        return False
+    fig = plt.figure(figsize=figsize)
+    try:
+        sns.barplot(data=unique_authors_per_month, x='time', y='id')
+        plt.title(f'{institution_name} Monthly Unique First Authorship')
+        plt.xlabel('Month')
+        plt.ylabel('Unique First Authors')
+        plt.xticks(rotation=45)
+        plt.tight_layout()
+        _savefig(fig, directory, 'unique_authors_per_month', key, formats=formats, dpi=dpi)
+    finally:
+        plt.close(fig)
+    return True
+
+
+def plot_x(aggregates, directory, institution_name, figsize=(10, 6), formats=('png',), dpi=300):
+    rows = []
+    articles_by_month = aggregates.articles.drop(get_current_time(), errors='ignore')
+    for (d1, c1), (_d2, c2) in zip(aggregates.unique_authors.items(), articles_by_month.items()):
+        rows.append((d1, 100 * (1 - c1 / c2)))
+    data = pd.DataFrame(rows, columns=['time', 'percent'])
+    key = get_stale_render_key(
+        directory, 'percent_duplicate_authors_per_month', data, institution_name, figsize, formats, dpi,
+    )
+    if key is None:
+        return False
+    fig = plt.figure(figsize=figsize)
+    try:
+        sns.lineplot(data=data, x='time', y='percent')
+        plt.title(f'{institution_name} Percent Duplicate First Authors Each Month')
+        plt.xlabel('Month')
+        plt.ylabel('Percent Duplicate First Authors')
+        plt.xticks(rotation=45)
+        plt.tight_layout()
+        _savefig(fig, directory, 'percent_duplicate_authors_per_month', key, formats=formats, dpi=dpi)
+    finally:
+        plt.close(fig)
+    return True
+
+
+def plot_first_time_first_authors_by_month(
+    aggregates, directory, institution_name, figsize=(10, 6), formats=('png',), dpi=300,
+):
+    data = aggregates.first_time_authors.reset_index(name='orcid')
+    key = get_stale_render_key(
+        directory, 'first_time_first_authors_per_month', data, institution_name, figsize, formats, dpi,
+    )
+    if key is None:
+        return False
+    fig = plt.figure(figsize=figsize)
+    try:
+        sns.barplot(data=data, x='time', y='orcid')
+        plt.title(f'{institution_name} First Time First Authors per Month')
+        plt.xlabel('Month')
+        plt.ylabel('First Time First Authors')
+        plt.xticks(rotation=45)
+        plt.tight_layout()
+        _savefig(fig, directory, 'first_time_first_authors_per_month', key, formats=formats, dpi=dpi)
+    finally:
+        plt.close(fig)
+    return True
+
+
+def plot_prolific_authors(aggregates, directory, institution_name, figsize=(10, 6), formats=('png',), dpi=300):
+    # Who's prolific in this institution?
+    author_frequencies = aggregates.author_frequencies.sort_values(ascending=False).reset_index(name='id')
+    key = get_stale_render_key(
+        directory, 'author_prolificness', author_frequencies, institution_name, figsize, formats, dpi,
+    )
+    if key is None:
+        return False
+    fig = plt.figure(figsize=figsize)
+    try:
+        sns.histplot(author_frequencies, y='id', kde=False, binwidth=4)
+        plt.title(f'{institution_name} First Author Prolificness')
+        plt.ylabel('First Author Frequency')
+        plt.xlabel('Number of Articles Submitted')
+        plt.xscale('log')
+        plt.tight_layout()
+        _savefig(fig, directory, 'author_prolificness', key, formats=formats, dpi=dpi)
+    finally:
+        plt.close(fig)
+    return True
+
+
+def plot_cumulative_authors(aggregates, directory, institution_name, figsize=(10, 6), formats=('png',), dpi=300):
+    # Cumulative number of unique authors over time, based on the month of each author's first article
+    unique_historical_authors = aggregates.first_time_authors.cumsum()
+    key = get_stale_render_key(
+        directory, 'historical_authorship', unique_historical_authors, institution_name, figsize, formats, dpi,
+    )
+    if key is None:
+        return False
+
+    fig = plt.figure(figsize=figsize)
+    try:
+        sns.lineplot(data=unique_historical_authors)
+        plt.xticks(rotation=45)
+
+        plt.title(f'{institution_name} Historical Unique First Time First Authorship')
+        plt.ylabel('Cumulative Unique First Time First Authorship')
+        plt.xlabel('Month')
+        plt.tight_layout()
+        _savefig(fig, directory, 'historical_authorship', key, formats=formats, dpi=dpi)
+    finally:
+        plt.close(fig)
+    return True
+
+
+def plot_cumulative_licenses(aggregates, directory, institution_name, figsize=(10, 6), formats=('png',), dpi=300):
+    # Cumulative number of licenses over time
+    key = get_stale_render_key(
+        directory, 'historical_licenses', aggregates.licenses, institution_name, figsize, formats, dpi,
+    )
+    if key is None:
+        return False
+    fig, ax = plt.subplots(1, 1, figsize=figsize)
+    try:
+
+        for license, counts in aggregates.licenses.items():
+            historical_licenses = counts[0 < counts].cumsum()
+            sns.lineplot(data=historical_licenses, ax=ax, label=license)
+
+        plt.xticks(rotation=45)
+        plt.title(f'{institution_name} Historical Licenses')
+        plt.ylabel('Cumulative Articles')
+        plt.xlabel('Month')
+        plt.tight_layout()
+        _savefig(fig, directory, 'historical_licenses', key, formats=formats, dpi=dpi)
+    finally:
+        plt.close(fig)
+    return True
+
+
+def plot_gender_evolution(aggregates, directory, institution_name, figsize=(10, 6), formats=('png',), dpi=300):
+    data = get_gender_counts(aggregates, assign_andy=True)
+    key = get_stale_render_key(directory, 'genders_by_month', data, institution_name, figsize, formats, dpi)
+    if key is None:
+        return False
+
+    fig = plt.figure(figsize=figsize)
+    try:
+        sns.lineplot(data=data, x='time', y='id', hue='first_author_inferred_gender')
+
+        plt.xticks(rotation=45)
+        plt.title(f'{institution_name} Inferred First Author Genders')
+        plt.ylabel('Articles')
+        plt.xlabel('Month')
+        plt.tight_layout()
+        _savefig(fig, directory, 'genders_by_month', key, formats=formats, dpi=dpi)
+    finally:
+        plt.close(fig)
+    return True
+
+
+def plot_gender_male_percentage(aggregates, directory, institution_name, figsize=(10, 6), formats=('png',), dpi=300):
+    nd = get_gender_counts(aggregates).pivot(
+        index='time',
+        columns='first_author_inferred_gender',
+        values='id'
+    ).fillna(0).astype(int)
+    nd['ratio'] = (nd['male'] + 0.5 * nd['andy']) / (nd['male'] + nd['female'] + nd['andy'])
+    key = get_stale_render_key(directory, 'male_percentage_by_month', nd, institution_name, figsize, formats, dpi)
+    if key is None:
+        return False
+
+    fig = plt.figure(figsize=figsize)
+    try:
+        sns.lineplot(data=nd, x='time', y='ratio')
+        plt.xticks(rotation=45)
+        plt.title(f'{institution_name} Inferred First Author Male Percentage')
+        plt.ylabel('Male Percentage')
+        plt.xlabel('Month')
+        plt.tight_layout()
+        _savefig(fig, directory, 'male_percentage_by_month', key, formats=formats, dpi=dpi)
+    finally:
+        plt.close(fig)
+    return True
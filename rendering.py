@@ -0,0 +1,163 @@
+"""Render charts in parallel with the headless Agg backend.
+
+Each chart is a plot function from :mod:`plots` and its keyword arguments. They're
+sent to a process pool, so regenerating all charts takes about as long as the
+slowest one.
+
+Plot functions skip drawing if their chart is already up to date. This is decided
+with a hash of the data the chart shows and its parameters, which is kept in the
+``.render_cache`` folder next to the chart after it's saved.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import click
+import matplotlib
+import pandas as pd
+
+import metrics
+
+#: Bump this when the look of the charts changes so they all get rendered again
+RENDER_CACHE_VERSION = 1
+RENDER_CACHE_DIRECTORY_NAME = '.render_cache'
+
+#: Charts drawn in this process are drawn one at a time, since pyplot's state is shared by all threads
+_PYPLOT_LOCK = threading.Lock()
+
+#: A plot function, which returns whether it drew the chart, and its keyword arguments
+Chart = Tuple[Callable[..., bool], Mapping[str, Any]]
+
+
+def _split_formats(_ctx, _param, value: str) -> Tuple[str, ...]:
+    return tuple(extension.strip().lstrip('.') for extension in value.split(',') if extension.strip())
+
+
+render_workers_option = click.option(
+    '--workers', type=int, default=1, show_default=True, help='Number of charts rendered in parallel',
+)
+formats_option = click.option(
+    '--formats', default='png', show_default=True, callback=_split_formats,
+    help='Comma-separated image formats to save each chart as, like png,svg',
+)
+dpi_option = click.option('--dpi', type=int, default=300, show_default=True, help='Resolution of raster formats')
+force_option = click.option('--force', is_flag=True, help='Render charts even if their data has not changed')
+
+
+def get_stale_render_key(directory: str, name: str, data, *params) -> Optional[str]:
+    """Get the key for a chart, or None if it's already been saved with the same key in each format.
+
+    :param directory: The directory the chart is saved in
+    :param name: The chart's file name, without an extension
+    :param data: The data frame or series shown in the chart
+    :param params: Everything else that changes how the chart looks, like its title and size. The
+        last two have to be the formats and DPI.
+    """
+    *_, formats, _dpi = params
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(data).to_numpy().tobytes())
+    columns = list(data.columns) if isinstance(data, pd.DataFrame) else []
+    digest.update(json.dumps([RENDER_CACHE_VERSION, name, columns, *params], default=str).encode('utf-8'))
+    key = digest.hexdigest()
+
+    path = _get_render_key_path(directory, name)
+    if not os.path.exists(path) or any(
+        not os.path.exists(os.path.join(directory, f'{name}.{extension}'))
+        for extension in formats
+    ):
+        return key
+    with open(path) as file:
+        if file.read().strip() != key:
+            return key
+    return None
+
+
+def write_render_key(directory: str, name: str, key: str) -> None:
+    """Remember the key of a chart that was just saved."""
+    path = _get_render_key_path(directory, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(key)
+
+
+def clear_render_cache(directory: str) -> None:
+    """Forget the keys of all charts in the directory, so they're all rendered again."""
+    shutil.rmtree(os.path.join(directory, RENDER_CACHE_DIRECTORY_NAME), ignore_errors=True)
+
+
+def _get_render_key_path(directory: str, name: str) -> str:
+    return os.path.join(directory, RENDER_CACHE_DIRECTORY_NAME, f'{name}.sha256')
+
+
+def get_chart_paths(directory: str, formats: Sequence[str]) -> List[str]:
+    """Get the paths of the key and the file in each format of every chart that's been rendered in the directory."""
+    cache_directory = os.path.join(directory, RENDER_CACHE_DIRECTORY_NAME)
+    if not os.path.isdir(cache_directory):
+        return []
+    names = sorted(name[:-len('.sha256')] for name in os.listdir(cache_directory) if name.endswith('.sha256'))
+    return [
+        path
+        for name in names
+        for path in (
+            _get_render_key_path(directory, name),
+            *(os.path.join(directory, f'{name}.{extension}') for extension in formats),
+        )
+    ]
+
+
+def render_charts(
+    charts: Sequence[Chart],
+    *,
+    workers: int = 1,
+    formats: Sequence[str] = ('png',),
+    dpi: int = 300,
+) -> Dict[str, float]:
+    """Render each chart that's out of date, then report how long each took.
+
+    :param charts: Pairs of plot functions and the keyword arguments to call them with
+    :param workers: The number of processes used to render charts
+    :param formats: The image formats to save each chart as
+    :param dpi: The resolution of raster formats
+    :returns: The number of seconds each plot function took to render, by the function's name.
+        Charts that were already up to date are left out.
+    """
+    jobs = [(function, {**kwargs, 'formats': tuple(formats), 'dpi': dpi}) for function, kwargs in charts]
+    durations = {}
+
+    def _report(name: str, rendered: bool, duration: float) -> None:
+        if not rendered:
+            click.echo(f'Skipped {name}, its data has not changed')
+            metrics.inc('charts_total', result='skipped')
+            return
+        metrics.inc('charts_total', result='rendered')
+        metrics.observe('chart_render_seconds', duration, chart=name)
+        durations[name] = duration
+        click.echo(f'Rendered {name} in {duration:.2f}s')
+
+    if workers == 1:
+        _init_worker()
+        with _PYPLOT_LOCK:
+            for job in jobs:
+                _report(*_render(job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            for future in as_completed([executor.submit(_render, job) for job in jobs]):
+                _report(*future.result())
+    return durations
+
+
+def _init_worker() -> None:
+    matplotlib.use('Agg')
+
+
+def _render(job: Chart) -> Tuple[str, bool, float]:
+    function, kwargs = job
+    start = time.perf_counter()
+    rendered = function(**kwargs)
+    return function.__name__, rendered, time.perf_counter() - start
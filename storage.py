@@ -0,0 +1,302 @@
+"""Storage backends for downloaded records.
+
+There are two ways records can be stored:
+
+1. ``directory`` keeps one pretty-printed JSON file per record, like ``articles_long/1234.json``.
+   This is the original layout and is easy to poke around in.
+2. ``sqlite`` appends compressed, compact JSON into a single SQLite file next to where the directory
+   would have been, like ``articles_long.sqlite``, keyed on the record's identifier. This avoids
+   hundreds of thousands of small files and makes reading everything back a sequential scan.
+
+Move an existing crawl between the two with ``python storage.py <directory> --to sqlite``.
+
+Neither leaves a partly written record behind if the process is killed. JSON files are written
+to a temporary file and renamed over the record with :func:`write_json`, and SQLite writes
+are transactional.
+"""
+
+import abc
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import click
+from tqdm import tqdm
+
+BACKENDS = ('directory', 'sqlite')
+
+#: The number of writes to the SQLite backend between commits
+COMMIT_INTERVAL = 500
+
+#: The suffix of the temporary files that :func:`write_json` renames into place
+TEMPORARY_SUFFIX = '.tmp'
+
+
+def write_json(path: str, obj, **kwargs) -> None:
+    """Write JSON to a file atomically, so it's never left partly written.
+
+    The JSON is written to a temporary file next to the path, which is then renamed over it.
+    Keyword arguments are passed to :func:`json.dump`.
+    """
+    directory, name = os.path.split(path)
+    # The process and thread make the name unique, so concurrent writers don't clobber each other
+    temporary_path = os.path.join(directory, f'.{name}.{os.getpid()}.{threading.get_ident()}{TEMPORARY_SUFFIX}')
+    try:
+        with open(temporary_path, 'w') as file:
+            json.dump(obj, file, **kwargs)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+class Store(abc.ABC):
+    """A collection of JSON records, each with a unique string key."""
+
+    @abc.abstractmethod
+    def keys(self) -> Set[str]:
+        """Get the keys of all records in the store."""
+
+    @abc.abstractmethod
+    def get(self, key: str):
+        """Get the record with the given key, raising a :class:`KeyError` if it's not there."""
+
+    @abc.abstractmethod
+    def put(self, key: str, record) -> None:
+        """Add a record to the store, overwriting any previous record with the same key."""
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove a record from the store, if it's there."""
+
+    @abc.abstractmethod
+    def versions(self) -> Dict[str, int]:
+        """Get a number for each key that changes whenever the record is overwritten."""
+
+    @abc.abstractmethod
+    def iter_raw(self, keys: Optional[Iterable[str]] = None) -> Iterable[Tuple[str, bytes]]:
+        """Iterate over the keys and undecoded records in the store, or only the given keys.
+
+        A :class:`KeyError` is raised when one of the given keys isn't there.
+        """
+
+    @staticmethod
+    @abc.abstractmethod
+    def loads(data: bytes):
+        """Decode a record from :meth:`iter_raw`."""
+
+    def iter_records(self, keys: Optional[Iterable[str]] = None) -> Iterable[Tuple[str, object]]:
+        """Iterate over the key/record pairs in the store, or only the given keys."""
+        for key, data in self.iter_raw(keys):
+            yield key, self.loads(data)
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys()
+
+    def close(self) -> None:
+        """Flush any pending writes."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DirectoryStore(Store):
+    """Store each record as a separate, pretty-printed JSON file in a directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def keys(self) -> Set[str]:
+        return {
+            entry.name[:-len('.json')]
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith('.json')
+        }
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str):
+        try:
+            with open(self._path(key)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+    def put(self, key: str, record) -> None:
+        write_json(self._path(key), record, indent=2)
+
+    def delete(self, key: str) -> None:
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def versions(self) -> Dict[str, int]:
+        return {
+            entry.name[:-len('.json')]: entry.stat().st_mtime_ns
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith('.json')
+        }
+
+    def iter_raw(self, keys: Optional[Iterable[str]] = None) -> Iterable[Tuple[str, bytes]]:
+        if keys is None:
+            keys = (name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json'))
+        for key in keys:
+            try:
+                with open(self._path(key), 'rb') as file:
+                    data = file.read()
+            except FileNotFoundError:
+                raise KeyError(key) from None
+            yield key, data
+
+    @staticmethod
+    def loads(data: bytes):
+        return json.loads(data)
+
+
+class SQLiteStore(Store):
+    """Store records as zlib-compressed compact JSON in a single SQLite file.
+
+    The connection is shared between threads, so all access goes through a lock.
+    Each record's version is the CRC32 of its compressed data.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, data BLOB NOT NULL, version INTEGER)'
+        )
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(records)')}
+        if 'version' not in columns:  # upgrade stores made before versions were tracked
+            self.connection.create_function('crc32', 1, zlib.crc32, deterministic=True)
+            self.connection.execute('ALTER TABLE records ADD COLUMN version INTEGER')
+            self.connection.execute('UPDATE records SET version = crc32(data)')
+        self.connection.commit()
+        self.pending = 0
+
+    @staticmethod
+    def _dumps(record) -> bytes:
+        return zlib.compress(json.dumps(record, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def loads(data: bytes):
+        return json.loads(zlib.decompress(data))
+
+    def keys(self) -> Set[str]:
+        with self.lock:
+            return {key for key, in self.connection.execute('SELECT key FROM records')}
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM records WHERE key = ?', (key,)).fetchone() is not None
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM records WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.loads(row[0])
+
+    def put(self, key: str, record) -> None:
+        data = self._dumps(record)
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO records (key, data, version) VALUES (?, ?, ?)', (key, data, zlib.crc32(data)),
+            )
+            self.pending += 1
+            if COMMIT_INTERVAL <= self.pending:
+                self.connection.commit()
+                self.pending = 0
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            self.connection.execute('DELETE FROM records WHERE key = ?', (key,))
+            self.connection.commit()
+
+    def versions(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.connection.execute('SELECT key, version FROM records'))
+
+    def iter_raw(self, keys: Optional[Iterable[str]] = None) -> Iterable[Tuple[str, bytes]]:
+        # Reading with a separate connection means a long scan doesn't hold the lock,
+        # but it only sees committed writes
+        with self.lock:
+            self.connection.commit()
+            self.pending = 0
+        connection = sqlite3.connect(self.path)
+        try:
+            if keys is None:
+                yield from connection.execute('SELECT key, data FROM records ORDER BY rowid')
+            else:
+                for key in keys:
+                    row = connection.execute('SELECT data FROM records WHERE key = ?', (key,)).fetchone()
+                    if row is None:
+                        raise KeyError(key)
+                    yield key, row[0]
+        finally:
+            connection.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.commit()
+            self.pending = 0
+
+
+def get_store(directory: str, backend: str = 'directory') -> Store:
+    """Get the store for records that would live in the given directory with the original layout."""
+    if backend == 'directory':
+        return DirectoryStore(directory)
+    if backend == 'sqlite':
+        return SQLiteStore(f'{directory.rstrip(os.sep)}.sqlite')
+    raise ValueError(f'unknown storage backend: {backend}')
+
+
+def has_store(directory: str, backend: str = 'directory') -> bool:
+    """Check if the store for the given directory exists, without making it."""
+    if backend == 'sqlite':
+        return os.path.isfile(f'{directory.rstrip(os.sep)}.sqlite')
+    return os.path.isdir(directory)
+
+
+backend_option = click.option(
+    '--backend', type=click.Choice(BACKENDS), default='directory', show_default=True,
+    help='How downloaded records are stored',
+)
+
+
+@click.command()
+@click.argument('directory', type=click.Path(file_okay=False, dir_okay=True))
+@click.option('--from', 'source', type=click.Choice(BACKENDS), default='directory', show_default=True)
+@click.option('--to', 'target', type=click.Choice(BACKENDS), default='sqlite', show_default=True)
+def main(directory: str, source: str, target: str):
+    """Copy all records for DIRECTORY from one storage backend to another."""
+    if source == target:
+        raise click.UsageError('--from and --to must be different')
+    with get_store(directory, source) as source_store, get_store(directory, target) as target_store:
+        for key, record in tqdm(source_store.iter_records(), total=len(source_store), desc=f'Migrating to {target}'):
+            target_store.put(key, record)
+
+
+if __name__ == '__main__':
+    main()
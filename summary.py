@@ -0,0 +1,531 @@
+"""Summarize downloaded records into typed tables and load them back."""
+
+import datetime
+import heapq
+import json
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+import metrics
+from authors import AUTHOR_COLUMNS, AuthorIndex, get_author_paths, get_author_rows
+from gender import GenderCache
+from storage import Store, write_json
+from utils import iter_chunks
+
+#: The number of records sent to a parsing process at a time
+CHUNK_SIZE = 1000
+
+#: Summary columns with few distinct values, which are stored as categoricals
+SUMMARY_CATEGORIES = ('license', 'first_author_inferred_gender', 'category')
+
+#: The columns of a summary without any rows, which are the ones every summary has
+EMPTY_SUMMARY_COLUMNS = ['id', 'title', 'posted']
+
+#: The most sorted runs read at once when merging batches of a summary
+MERGE_FAN_IN = 16
+
+
+def get_figshare_row(_key: str, j: Mapping[str, Any]) -> Mapping[str, Any]:
+    """Get a summary row for a full Figshare article record."""
+    orcid = None
+    for custom_field in j.get('custom_fields', []):
+        if custom_field['name'] == 'ORCID For Submitting Author':
+            orcid = custom_field['value']
+
+    return dict(
+        id=j['id'],
+        title=j['title'],
+        posted=j['timeline']['posted'],
+        license=j['license']['name'],
+        orcid=orcid,
+        first_author_name=j['authors'][0]['full_name'],
+        # Like the orcid column, the submitting author is taken to be the first author
+        authors=[
+            (author['full_name'], author.get('orcid_id') or (orcid if position == 0 else None))
+            for position, author in enumerate(j['authors'])
+        ],
+    )
+
+
+def get_figshare_first_names(names: pd.Series) -> pd.Series:
+    """Get the first name from each full name."""
+    return names.str.split(' ').str[0]
+
+
+def build_summary(
+    store: Store,
+    path: str,
+    get_row: Callable[[str, Any], Optional[Mapping[str, Any]]],
+    get_first_names: Callable[[pd.Series], pd.Series],
+    sort_by: str,
+    incremental: bool = False,
+    jobs: int = 1,
+    batch_size: Optional[int] = None,
+) -> Optional[pd.DataFrame]:
+    """Summarize each record in the store as a row in a TSV file.
+
+    :param store: The records to summarize
+    :param path: The TSV file to write. A typed Parquet version is written next to it.
+    :param get_row: A function from a key and record to a row, or None if the record should be
+        skipped. It has to be defined at the top level of a module when ``jobs`` isn't 1 so it can
+        be sent to the worker processes. If the row has an ``authors`` list of (name, ORCID) pairs,
+        it's moved into an author table that's indexed for lookups by :mod:`authors`.
+    :param get_first_names: A function from the ``first_author_name`` column to the first names
+        used for inferring genders, which are missing if the gender should be unknown. The inferred
+        genders are added in the ``first_author_inferred_gender`` column right after it.
+    :param sort_by: The column to sort the rows by
+    :param incremental: If true, only the records that were added or changed since the last run
+        are parsed and merged into the existing TSV file. This relies on a manifest of the version
+        of each record and the id of its row, stored next to the TSV file.
+    :param jobs: The number of processes used to decode and summarize records. If 0, uses all cores.
+        The output is the same no matter how many are used.
+    :param batch_size: If given, the rows and author rows are streamed in typed batches of this size,
+        each of which is sorted and written to a temporary run, then the runs are merged into the output
+        :data:`MERGE_FAN_IN` at a time. The author index is then built from the outputs a batch at a time.
+        Besides the batches, memory only grows with the manifest and the author index rather than with
+        the whole summary. The output is the same as without batches.
+    :returns: The summary, unless it was built in batches since then it's never all in memory
+    """
+    manifest_path = f'{os.path.splitext(path)[0]}.manifest.json'
+    authors_path, author_index_path = get_author_paths(path)
+    manifest = {}
+    if incremental and os.path.exists(path) and os.path.exists(manifest_path) and os.path.exists(authors_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+    versions = store.versions()
+    if manifest:
+        changed = [key for key, version in versions.items() if key not in manifest or manifest[key][0] != version]
+        stale = {key for key in manifest if key not in versions}.union(changed)
+        raw_records = store.iter_raw(changed)
+        total = len(changed)
+    else:
+        stale = set()
+        raw_records = store.iter_raw()
+        total = len(versions)
+
+    new_manifest = {key: value for key, value in manifest.items() if key not in stale}
+    stale_ids = {manifest[key][1] for key in stale if key in manifest}
+    results = tqdm(
+        iter_rows(raw_records, get_row=get_row, loads=store.loads, jobs=jobs or os.cpu_count()),
+        total=total, desc=f'Summarizing {os.path.basename(path)}',
+    )
+    genders = GenderCache()
+    # Break ties on the id so the output doesn't depend on the order records were read in
+    sort_key = list(dict.fromkeys([sort_by, 'id']))
+
+    if batch_size:
+        df = None
+        _build_summary_in_batches(
+            results, path, authors_path, sort_key=sort_key, batch_size=batch_size, previous=bool(manifest),
+            stale_ids=stale_ids,
+            summarize=partial(
+                _summarize, versions=versions, manifest=new_manifest, get_first_names=get_first_names, genders=genders,
+            ),
+        )
+        genders.save()
+        with metrics.timer('author_index_seconds'):
+            with _read_tsv(path, usecols=EMPTY_SUMMARY_COLUMNS, chunksize=batch_size) as articles:
+                index = AuthorIndex.from_chunks(articles, _iter_parquet_run(authors_path, batch_size))
+            index.save(author_index_path)
+    else:
+        df, authors_df = _summarize(
+            results, versions=versions, manifest=new_manifest, get_first_names=get_first_names, genders=genders,
+        )
+        if manifest:
+            previous_df = _read_tsv(path)
+            df = pd.concat([previous_df[~previous_df['id'].isin(stale_ids)], df], ignore_index=True)
+            previous_authors_df = pd.read_parquet(authors_path)
+            authors_df = pd.concat(
+                [previous_authors_df[~previous_authors_df['id'].isin(stale_ids)], authors_df], ignore_index=True,
+            )
+        df = df.sort_values(sort_key, kind='stable')
+        write_summary(df, path)
+        genders.save()
+        authors_df = _clean_authors(authors_df)
+        _write_authors(authors_df, authors_path)
+        with metrics.timer('author_index_seconds'):
+            AuthorIndex.from_tables(df, authors_df).save(author_index_path)
+
+    write_json(manifest_path, new_manifest)
+
+    return df
+
+
+def _summarize(
+    results: Iterable[Tuple[str, Optional[Dict[str, Any]]]],
+    *,
+    versions: Mapping[str, int],
+    manifest: Dict[str, list],
+    get_first_names: Callable[[pd.Series], pd.Series],
+    genders: GenderCache,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Make the summary and author table for some parsed records, adding them to the manifest."""
+    rows = []
+    author_rows = []
+    for key, row in results:
+        manifest[key] = [versions.get(key), None if row is None else row['id']]
+        if row is not None:
+            author_rows.extend(get_author_rows(row['id'], row.pop('authors', [])))
+            rows.append(row)
+
+    if not rows:
+        return pd.DataFrame(columns=EMPTY_SUMMARY_COLUMNS), pd.DataFrame(columns=AUTHOR_COLUMNS)
+    df = pd.DataFrame(rows)
+    df.insert(
+        df.columns.get_loc('first_author_name') + 1,
+        'first_author_inferred_gender',
+        _infer_genders(genders, get_first_names(df['first_author_name'])),
+    )
+    return df, pd.DataFrame(author_rows, columns=AUTHOR_COLUMNS)
+
+
+def _clean_authors(authors_df: pd.DataFrame) -> pd.DataFrame:
+    """Sort an author table by article and position, and remove its malformed ORCIDs."""
+    authors_df = authors_df.sort_values(['id', 'position'], kind='stable')
+    has_orcid = authors_df['orcid'].notna()
+    orcids, problems = clean_orcids(authors_df.loc[has_orcid, 'orcid'])
+    authors_df.loc[has_orcid, 'orcid'] = orcids.where(problems.isna())
+    return authors_df
+
+
+def _infer_genders(genders: GenderCache, first_names: pd.Series) -> pd.Series:
+    with metrics.timer('gender_inference_seconds'):
+        rv = genders.infer(first_names)
+    metrics.inc('gender_inferences_total', len(rv))
+    return rv
+
+
+def _build_summary_in_batches(
+    results: Iterable[Tuple[str, Optional[Dict[str, Any]]]],
+    path: str,
+    authors_path: str,
+    *,
+    sort_key: List[str],
+    batch_size: int,
+    previous: bool,
+    stale_ids: Set,
+    summarize: Callable[[Iterable], Tuple[pd.DataFrame, pd.DataFrame]],
+) -> None:
+    """Write the summary and author table by sorting each batch of rows into a run, then merging the runs.
+
+    :param previous: If true, the rows of the existing summary and author table, except the ones
+        with ``stale_ids``, are merged in too
+    """
+    # Runs are read back a slice of a batch at a time, so merging MERGE_FAN_IN of them holds about one batch
+    chunk_size = max(1, batch_size // MERGE_FAN_IN)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as directory:
+        run_paths = []
+        author_run_paths = []
+        columns = None
+        for i, batch in enumerate(iter_chunks(results, batch_size)):
+            df, authors_df = summarize(batch)
+            if not authors_df.empty:
+                author_run_paths.append(os.path.join(directory, f'authors_{i}.pickle'))
+                authors_df = _clean_authors(authors_df).reindex(columns=AUTHOR_COLUMNS)
+                _write_run(authors_df.itertuples(index=False, name=None), author_run_paths[-1], chunk_size)
+            if df.empty:
+                continue
+            columns = columns or list(df.columns)
+            run_paths.append(os.path.join(directory, f'run_{i}.pickle'))
+            df = df.sort_values(sort_key, kind='stable').reindex(columns=columns)
+            _write_run(df.itertuples(index=False, name=None), run_paths[-1], chunk_size)
+
+        runs = []
+        author_runs = []
+        if previous:
+            columns = columns or list(_read_tsv(path, nrows=0).columns)
+            runs.append(_iter_tuples(_iter_tsv_run(path, chunk_size, stale_ids), columns))
+            author_runs.append(_iter_tuples(_iter_parquet_run(authors_path, chunk_size, stale_ids), AUTHOR_COLUMNS))
+        columns = columns or EMPTY_SUMMARY_COLUMNS
+
+        # Written next to the outputs and moved over them at the end, since the existing ones are runs
+        temporary_path = os.path.join(directory, os.path.basename(path))
+        key_indexes = [columns.index(column) for column in sort_key]
+        rows = _merge_runs(
+            run_paths, runs, directory, chunk_size, key=lambda row: tuple(row[i] for i in key_indexes)
+        )
+        _write_summary_in_batches(rows, columns, temporary_path, batch_size)
+        # Author rows start with their article's id and their position, which are unique, so they merge as is
+        temporary_authors_path = os.path.join(directory, os.path.basename(authors_path))
+        author_rows = _merge_runs(author_run_paths, author_runs, directory, chunk_size)
+        _write_authors_in_batches(author_rows, temporary_authors_path, batch_size)
+        os.replace(temporary_path, path)
+        os.replace(_get_parquet_path(temporary_path), _get_parquet_path(path))
+        os.replace(temporary_authors_path, authors_path)
+
+
+def _merge_runs(
+    paths: List[str],
+    runs: List[Iterable[tuple]],
+    directory: str,
+    chunk_size: int,
+    key: Optional[Callable[[tuple], Any]] = None,
+) -> Iterable[tuple]:
+    """Merge the sorted runs in ``paths`` and ``runs``.
+
+    While there are more than :data:`MERGE_FAN_IN` runs, groups of them are first merged into longer runs
+    in ``directory``, so only that many are ever read at once.
+    """
+    paths = list(paths)
+    while len(paths) + len(runs) > MERGE_FAN_IN:
+        group, paths = paths[:MERGE_FAN_IN], paths[MERGE_FAN_IN:]
+        handle, merged_path = tempfile.mkstemp(suffix='.pickle', dir=directory)
+        os.close(handle)
+        _write_run(heapq.merge(*map(_iter_run, group), key=key), merged_path, chunk_size)
+        for run_path in group:
+            os.remove(run_path)
+        paths.append(merged_path)
+    return heapq.merge(*map(_iter_run, paths), *runs, key=key)
+
+
+def _write_run(rows: Iterable[tuple], path: str, chunk_size: int) -> None:
+    with open(path, 'wb') as file:
+        for chunk in iter_chunks(rows, chunk_size):
+            pickle.dump(chunk, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _iter_run(path: str) -> Iterable[tuple]:
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                chunk = pickle.load(file)
+            except EOFError:
+                return
+            yield from chunk
+
+
+def _iter_parquet_run(path: str, batch_size: int, stale_ids: Set = frozenset()) -> Iterable[pd.DataFrame]:
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        df = batch.to_pandas()
+        yield df[~df['id'].isin(stale_ids)] if stale_ids else df
+
+
+def _iter_tsv_run(path: str, batch_size: int, stale_ids: Set) -> Iterable[pd.DataFrame]:
+    for df in _read_tsv(path, chunksize=batch_size):
+        yield df[~df['id'].isin(stale_ids)]
+
+
+def _iter_tuples(dfs: Iterable[pd.DataFrame], columns: Sequence[str]) -> Iterable[tuple]:
+    for df in dfs:
+        yield from df.reindex(columns=columns).itertuples(index=False, name=None)
+
+
+def _write_summary_in_batches(rows: Iterable[tuple], columns: List[str], path: str, batch_size: int) -> None:
+    """Append batches of rows to a TSV file and a typed Parquet file, like :func:`write_summary`."""
+    writer = None
+    try:
+        for i, batch in enumerate(iter_chunks(rows, batch_size)):
+            df = pd.DataFrame(batch, columns=columns)
+            df.to_csv(path, sep='\t', index=False, mode='w' if i == 0 else 'a', header=i == 0)
+            table = pa.Table.from_pandas(type_summary(df), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(_get_parquet_path(path), _get_summary_schema(table.schema))
+            writer.write_table(table.cast(writer.schema))
+        if writer is None:  # no rows at all
+            pd.DataFrame(columns=columns).to_csv(path, sep='\t', index=False)
+            type_summary(pd.DataFrame(columns=columns)).to_parquet(_get_parquet_path(path), index=False)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_authors_in_batches(rows: Iterable[tuple], path: str, batch_size: int) -> None:
+    """Write batches of author rows to a Parquet file."""
+    writer = None
+    try:
+        for batch in iter_chunks(rows, batch_size):
+            table = pa.Table.from_pandas(pd.DataFrame(batch, columns=AUTHOR_COLUMNS), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, _get_author_schema(table.schema))
+            writer.write_table(table.cast(writer.schema))
+        if writer is None:  # no authors at all
+            _write_authors(pd.DataFrame(columns=AUTHOR_COLUMNS), path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_authors(authors_df: pd.DataFrame, path: str) -> None:
+    """Write an author table to a Parquet file with the same schema as when it's written in batches."""
+    table = pa.Table.from_pandas(authors_df, preserve_index=False)
+    pq.write_table(table.cast(_get_author_schema(table.schema)), path)
+
+
+def _get_author_schema(schema: pa.Schema) -> pa.Schema:
+    """Get a schema that every batch of an author table fits, even ones whose names or ORCIDs are all missing."""
+    schema = _get_summary_schema(schema)
+    for column in ('name', 'orcid'):
+        i = schema.get_field_index(column)
+        schema = schema.set(i, schema.field(i).with_type(pa.large_string()))
+    return schema
+
+
+def _get_summary_schema(schema: pa.Schema) -> pa.Schema:
+    """Get a schema that every batch of a summary fits, no matter which values are in it."""
+    fields = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    # The pandas metadata describes the first batch's categories, so leave it out
+    return pa.schema(fields)
+
+
+def iter_rows(raw_records: Iterable[Tuple[str, bytes]], *, get_row, loads, jobs: int = 1):
+    """Decode and summarize each record with ``jobs`` processes, keeping them in order.
+
+    How long each record took is recorded in the ``parse_seconds`` metric.
+    """
+    summarize = partial(_summarize_chunk, get_row=get_row, loads=loads)
+    if jobs == 1:
+        yield from _record_rows(map(summarize, iter_chunks(raw_records, 1)))
+        return
+
+    with multiprocessing.Pool(jobs) as pool:
+        # imap keeps the chunks in order, so the output is the same as the serial path
+        yield from _record_rows(pool.imap(summarize, iter_chunks(raw_records, CHUNK_SIZE)))
+
+
+def _summarize_chunk(chunk: List[Tuple[str, bytes]], *, get_row, loads) -> List[Tuple[str, Any, float]]:
+    rv = []
+    for key, data in chunk:
+        start = time.perf_counter()
+        row = get_row(key, loads(data))
+        rv.append((key, row, time.perf_counter() - start))
+    return rv
+
+
+def _record_rows(chunks: Iterable[List[Tuple[str, Any, float]]]) -> Iterable[Tuple[str, Any]]:
+    """Record the time each row took to summarize, since the worker processes can't record metrics themselves."""
+    for chunk in chunks:
+        for key, row, seconds in chunk:
+            metrics.observe('parse_seconds', seconds)
+            metrics.inc('records_total', result='empty' if row is None else 'parsed')
+            yield key, row
+
+
+def _read_tsv(path: str, **kwargs):
+    """Read a summary TSV file. Only empty cells are missing, so values like ``NA`` survive a round trip."""
+    return pd.read_csv(path, sep='\t', keep_default_na=False, na_values=[''], **kwargs)
+
+
+def write_summary(df: pd.DataFrame, path: str) -> None:
+    """Write a summary as a TSV file and as a typed Parquet file next to it."""
+    df.to_csv(path, sep='\t', index=False)
+    type_summary(df).to_parquet(_get_parquet_path(path), index=False)
+
+
+def read_summary(path: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Read only the given columns of a summary, preferring its typed Parquet version.
+
+    Summaries written before the Parquet version existed are typed after reading the TSV file.
+    """
+    parquet_path = _get_parquet_path(path)
+    if os.path.exists(parquet_path) and (
+        not os.path.exists(path) or os.path.getmtime(path) <= os.path.getmtime(parquet_path)
+    ):
+        return pd.read_parquet(parquet_path, columns=columns)
+    df = type_summary(_read_tsv(path))
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+
+def _get_parquet_path(path: str) -> str:
+    return f'{os.path.splitext(path)[0]}.parquet'
+
+
+def type_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """Parse the posted dates, add the year, month, and time keys, and make categories for repeated values."""
+    df = df.copy()
+    df['year'] = df['posted'].str.slice(0, 4).astype('int16')
+    df['month'] = df['posted'].str.slice(5, 7).astype('int8')
+    df['time'] = (df['year'] - 2000).astype(str) + '-' + df['month'].astype(str).str.zfill(2)
+    df['posted'] = pd.to_datetime(df['posted'], format='ISO8601', utc=True)
+    for column in SUMMARY_CATEGORIES:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def get_df(
+    directory: str,
+    exclude_current_month: bool = False,
+    columns: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    """Load the summary for the articles with a valid ORCID.
+
+    :param directory: The institution's directory
+    :param exclude_current_month: Should articles from the current month be removed?
+    :param columns: The columns to load. The ``id``, ``orcid``, and ``time`` columns are always loaded.
+    """
+    df, _problems = get_df_with_diagnostics(directory, exclude_current_month=exclude_current_month, columns=columns)
+    return df
+
+
+def get_df_with_diagnostics(
+    directory: str,
+    exclude_current_month: bool = False,
+    columns: Optional[Sequence[str]] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Load the summary like :func:`get_df` and also get a report on the malformed ORCIDs.
+
+    :returns: The summary and a dataframe with the ``id``, the original ``orcid``, and the
+        ``problem`` for each article whose ORCID was malformed
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys([*columns, 'id', 'orcid', 'time']))
+    df = read_summary(os.path.join(directory, 'articles_summary.tsv'), columns=columns)
+    df = df[df['orcid'].notna()]
+
+    orcids, problems = clean_orcids(df['orcid'])
+    report = pd.DataFrame({'id': df['id'], 'orcid': df['orcid'], 'problem': problems}).dropna(subset=['problem'])
+
+    df = df.assign(orcid=orcids)
+    df = df[orcids.str.startswith('0000')]
+
+    if exclude_current_month:
+        df = remove_current_month(df)
+
+    return df, report.reset_index(drop=True)
+
+
+def get_current_time() -> str:
+    """Get the key for the current month used in the ``time`` column."""
+    today = datetime.date.today()
+    return f'{today.year - 2000}-{today.month:02}'
+
+
+def remove_current_month(df: pd.DataFrame) -> pd.DataFrame:
+    df = df[df['time'] != get_current_time()]
+    return df
+
+
+def clean_orcids(orcids: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """Normalize ORCIDs, fixing ones missing a leading zero and removing orcid.org URL prefixes.
+
+    :returns: The normalized ORCIDs and a description of the problem with each, which is missing
+        for ones that are fine. ORCIDs that don't start with ``0000`` once normalized should be dropped.
+    """
+    orcids = orcids.str.strip().str.replace(' ', '', regex=False).str.replace(';', '', regex=False)
+    missing_leading_zero = orcids.str.startswith('000-')
+    orcids = orcids.str.replace(r'^(?:https?://)?orcid\.org/', '', regex=True)
+    orcids = orcids.mask(missing_leading_zero, '0' + orcids)
+
+    problems = pd.Series(None, index=orcids.index, dtype=object)
+    problems[~orcids.str.startswith('0000')] = 'does not start with 0000'
+    problems[~orcids.str.contains('-', regex=False)] = 'missing hyphens'
+    return orcids, problems
@@ -0,0 +1,124 @@
+"""Tests for downloading bioRxiv article details against the mock API."""
+
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import requests
+
+import biorxiv_01_download_days
+import biorxiv_02_download_articles
+import utils
+from mock_api import BIORXIV_REVISION_DAYS, MockAPI
+from storage import DirectoryStore
+
+WORKERS = 8
+#: The number of days of articles to download
+DAYS = 40
+
+
+class TestDownloadArticles(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.api = MockAPI(articles_per_day=20)
+        server = self.api.serve()
+        self.addCleanup(server.shutdown)
+        self.url = f'http://127.0.0.1:{server.server_port}'
+
+    def set_directory(self, name):
+        """Point the crawlers at a directory inside the temporary one, until the test is done."""
+        directory = os.path.join(self.directory, name)
+        metadata_directory = os.path.join(directory, 'metadata')
+        for module, attribute, value in [
+            (utils, 'BIORXIV_DIRECTORY', directory),
+            (utils, 'BIORXIV_METADATA_DIRECTORY', metadata_directory),
+            (utils, 'BIORXIV_ARTICLES_DIRECTORY', os.path.join(directory, 'articles')),
+            (biorxiv_01_download_days, 'BIORXIV_METADATA_DIRECTORY', metadata_directory),
+            (biorxiv_02_download_articles, 'BIORXIV_DIRECTORY', directory),
+            (biorxiv_02_download_articles, 'BIORXIV_METADATA_DIRECTORY', metadata_directory),
+        ]:
+            patcher = mock.patch.object(module, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return directory
+
+    def download_days(self, end: datetime.date, days: int = DAYS):
+        start = end - datetime.timedelta(days=days)
+        biorxiv_01_download_days.download_days(
+            datetime.datetime.combine(start, datetime.time()), datetime.datetime.combine(end, datetime.time()),
+            workers=WORKERS, rate_limit=None, retries=5, endpoint=f'{self.url}/pub',
+        )
+
+    def download(self, end: datetime.date, bulk: bool):
+        """Download the days up to the end day then their articles, returning the requests it took and the records."""
+        directory = self.set_directory('bulk' if bulk else 'single')
+        self.download_days(end)
+        self.api.reset_stats()
+        biorxiv_02_download_articles.download_articles(
+            workers=WORKERS, rate_limit=None, retries=5, backend='directory',
+            endpoint=f'{self.url}/details/biorxiv', bulk=bulk,
+        )
+        with utils.get_biorxiv_articles_store() as store:
+            records = {key: store.get(key) for key in store.keys()}
+        shutil.rmtree(directory)
+        return self.api.reset_stats()['requests'], records
+
+    def test_recent_articles(self):
+        # Before then, some of the mock articles have a second version that's posted in the future
+        end = datetime.date.today() - datetime.timedelta(days=BIORXIV_REVISION_DAYS + 1)
+        request_count, records = self.download(end, bulk=False)
+        bulk_request_count, bulk_records = self.download(end, bulk=True)
+        self.assertEqual(records, bulk_records)
+        self.assertLess(bulk_request_count, request_count / 4)
+
+    def test_failed_window(self):
+        # Articles first posted up to the failed window could have versions in it, so they're requested on their own
+        end = datetime.date.today() - datetime.timedelta(days=BIORXIV_REVISION_DAYS + 1)
+        newest = biorxiv_02_download_articles._get_window_start(datetime.date.today())
+        get_versions = biorxiv_02_download_articles._get_versions
+
+        def _get_versions(start, end, **kwargs):
+            if start == newest:
+                raise requests.ConnectionError('connection reset')
+            return get_versions(start, end, **kwargs)
+
+        _, records = self.download(end, bulk=False)
+        with mock.patch.object(biorxiv_02_download_articles, '_get_versions', _get_versions):
+            _, bulk_records = self.download(end, bulk=True)
+        self.assertEqual(records, bulk_records)
+
+    def test_old_articles(self):
+        # Harvesting every window since then would take more requests than getting each article
+        end = datetime.date(2020, 2, 1)
+        request_count, records = self.download(end, bulk=False)
+        bulk_request_count, bulk_records = self.download(end, bulk=True)
+        self.assertEqual(records, bulk_records)
+        self.assertLessEqual(bulk_request_count, request_count)
+
+    def test_failed_writes(self):
+        # The consumers have to keep draining the queue, or the producer blocks once it's full
+        self.set_directory('failed')
+        self.download_days(datetime.date(2020, 2, 1), days=5)
+        queue_size = mock.patch.object(biorxiv_02_download_articles, 'QUEUE_SIZE', 2)
+        put = mock.patch.object(DirectoryStore, 'put', side_effect=OSError('No space left on device'))
+        download = threading.Thread(
+            target=biorxiv_02_download_articles.download_articles, daemon=True, kwargs=dict(
+                workers=2, rate_limit=None, retries=5, backend='directory', endpoint=f'{self.url}/details/biorxiv',
+            ),
+        )
+        with queue_size, put:
+            download.start()
+            download.join(60)
+        self.assertFalse(download.is_alive(), 'the download hung')
+        with utils.get_biorxiv_articles_store() as store:
+            self.assertFalse(store.keys())
+
+
+if __name__ == '__main__':
+    unittest.main()
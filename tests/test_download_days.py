@@ -0,0 +1,74 @@
+"""Tests for choosing which bioRxiv days to crawl."""
+
+import datetime
+import unittest
+
+from biorxiv_01_download_days import (
+    DATE_FIELD, MAX_WINDOW_DAYS, WINDOW_RECORDS, _get_next_width, _iter_days, _split_window,
+)
+
+
+class TestIterDays(unittest.TestCase):
+    def test_start_and_end_are_crawled(self):
+        days = list(_iter_days(datetime.date(2024, 1, 10), datetime.date(2024, 1, 12)))
+        self.assertEqual(days, [datetime.date(2024, 1, 12), datetime.date(2024, 1, 11), datetime.date(2024, 1, 10)])
+
+    def test_one_day(self):
+        day = datetime.date(2024, 1, 10)
+        self.assertEqual(list(_iter_days(day, day)), [day])
+
+
+def _record(doi: str, day: str) -> dict:
+    return {'biorxiv_doi': doi, DATE_FIELD: day}
+
+
+class TestSplitWindow(unittest.TestCase):
+    days = [datetime.date(2024, 1, 12), datetime.date(2024, 1, 11), datetime.date(2024, 1, 10)]
+
+    def test_day_before_overlap(self):
+        # Each day's window also covers the day before, so publications are in both days they're listed under
+        records = [_record('a', '2024-01-09'), _record('b', '2024-01-10'), _record('c', '2024-01-12')]
+        self.assertEqual(_split_window(records, self.days), {
+            datetime.date(2024, 1, 12): [records[2]],
+            datetime.date(2024, 1, 11): [records[1]],
+            datetime.date(2024, 1, 10): [records[0], records[1]],
+        })
+
+    def test_keeps_order(self):
+        records = [_record('a', '2024-01-11'), _record('b', '2024-01-10'), _record('c', '2024-01-11')]
+        self.assertEqual(_split_window(records, self.days)[datetime.date(2024, 1, 11)], records)
+
+    def test_empty_days(self):
+        self.assertEqual(_split_window([], self.days), {day: [] for day in self.days})
+
+    def test_outside_of_window(self):
+        for day in ['2024-01-08', '2024-01-13']:
+            with self.subTest(day=day):
+                self.assertIsNone(_split_window([_record('a', '2024-01-10'), _record('b', day)], self.days))
+
+    def test_bad_dates(self):
+        for record in [{'biorxiv_doi': 'a'}, _record('a', None), _record('a', 'January 10')]:
+            with self.subTest(record=record):
+                self.assertIsNone(_split_window([record], self.days))
+
+
+class TestGetNextWidth(unittest.TestCase):
+    def test_aims_for_window_records(self):
+        self.assertEqual(_get_next_width(8, WINDOW_RECORDS), 8)
+        self.assertEqual(_get_next_width(8, WINDOW_RECORDS * 2 // 3), 12)
+
+    def test_at_most_doubles_or_halves(self):
+        self.assertEqual(_get_next_width(8, 1), 16)
+        self.assertEqual(_get_next_width(8, WINDOW_RECORDS * 100), 4)
+
+    def test_empty_window(self):
+        self.assertEqual(_get_next_width(8, 0), 16)
+
+    def test_bounds(self):
+        self.assertEqual(_get_next_width(1, WINDOW_RECORDS * 100), 1)
+        self.assertEqual(_get_next_width(MAX_WINDOW_DAYS, 0), MAX_WINDOW_DAYS)
+        self.assertEqual(_get_next_width(MAX_WINDOW_DAYS, 1), MAX_WINDOW_DAYS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Tests for running the pipeline's stages, skipping the ones that are up to date."""
+
+import os
+import tempfile
+import unittest
+from typing import List
+
+from pipeline import Pipeline, Stage
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_path = os.path.join(directory.name, 'pipeline_state.json')
+        #: The names of the stages that ran, in the order they finished
+        self.ran: List[str] = []
+        #: What each stage's inputs and outputs fingerprints are made of
+        self.inputs = {}
+        self.outputs = {}
+
+    def stage(self, name, dependencies=(), fail=False, checked=True):
+        def _run():
+            if fail:
+                raise RuntimeError(f'{name} broke')
+            self.ran.append(name)
+
+        return Stage(
+            name, _run, dependencies=dependencies,
+            inputs=(lambda: [self.inputs.get(name)]) if checked else None,
+            outputs=(lambda: [self.outputs.get(name)]) if checked else None,
+        )
+
+    def run_pipeline(self, stages, force=False):
+        self.ran.clear()
+        return Pipeline(stages, state_path=self.state_path, force=force).run()
+
+    def test_skips_up_to_date(self):
+        stages = [self.stage('a'), self.stage('b', ['a'])]
+        self.assertEqual(self.run_pipeline(stages), {'a': 'ran', 'b': 'ran'})
+        self.assertEqual(self.ran, ['a', 'b'])
+        self.assertEqual(self.run_pipeline(stages), {'a': 'skipped', 'b': 'skipped'})
+        self.assertEqual(self.ran, [])
+
+    def test_changed_inputs_or_outputs(self):
+        stages = [self.stage('a'), self.stage('b')]
+        self.run_pipeline(stages)
+        self.inputs['a'] = 'new records'
+        self.outputs['b'] = 'summary removed'
+        self.assertEqual(self.run_pipeline(stages), {'a': 'ran', 'b': 'ran'})
+
+    def test_unchecked_stages_always_run(self):
+        stages = [self.stage('download', checked=False), self.stage('process', ['download'])]
+        self.run_pipeline(stages)
+        self.assertEqual(self.run_pipeline(stages), {'download': 'ran', 'process': 'skipped'})
+
+    def test_force(self):
+        stages = [self.stage('a')]
+        self.run_pipeline(stages)
+        self.assertEqual(self.run_pipeline(stages, force=True), {'a': 'ran'})
+
+    def test_failure_blocks_dependents(self):
+        stages = [
+            self.stage('a', fail=True),
+            self.stage('b', ['a']),
+            self.stage('c', ['b']),
+            self.stage('d'),
+        ]
+        self.assertEqual(self.run_pipeline(stages), {'a': 'failed', 'b': 'blocked', 'c': 'blocked', 'd': 'ran'})
+        self.assertEqual(self.ran, ['d'])
+        # The failed stage wasn't recorded as finished, so it isn't skipped next time
+        stages[0] = self.stage('a')
+        self.assertEqual(self.run_pipeline(stages), {'a': 'ran', 'b': 'ran', 'c': 'ran', 'd': 'skipped'})
+
+    def test_dependencies_come_first(self):
+        with self.assertRaises(ValueError):
+            Pipeline([self.stage('b', ['a']), self.stage('a')], state_path=self.state_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+"""Tests that the record store backends behave the same."""
+
+import os
+import tempfile
+import unittest
+
+from storage import BACKENDS, get_store
+
+
+class TestStores(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_missing_keys(self):
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                with get_store(os.path.join(self.directory, backend), backend) as store:
+                    store.put('there', {'a': 1})
+                    self.assertEqual([key for key, _ in store.iter_raw(['there'])], ['there'])
+                    with self.assertRaises(KeyError):
+                        list(store.iter_raw(['there', 'missing']))
+                    with self.assertRaises(KeyError):
+                        store.get('missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
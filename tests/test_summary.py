@@ -0,0 +1,97 @@
+"""Tests for building summaries in batches and incrementally."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import biorxiv_03_process
+from generate_corpus import generate_corpus, get_corpus_store
+from summary import EMPTY_SUMMARY_COLUMNS, build_summary
+
+#: Small enough that the runs are merged in more than one level
+BATCH_SIZE = 7
+
+
+class TestBuildSummary(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        # Keep the shared gender cache out of the tests
+        patcher = mock.patch('summary.GenderCache.save')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self, store, name, **kwargs):
+        path = os.path.join(self.directory, name, 'articles.tsv')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        build_summary(
+            store, path, get_row=biorxiv_03_process.get_row, get_first_names=biorxiv_03_process.get_first_names,
+            sort_by='posted', **kwargs,
+        )
+        return path
+
+    def read(self, path):
+        stem = os.path.splitext(path)[0]
+        with open(path) as file:
+            tsv = file.read()
+        return tsv, pd.read_parquet(f'{stem}.authors.parquet')
+
+    def assert_same_outputs(self, path, other_path):
+        tsv, authors = self.read(path)
+        other_tsv, other_authors = self.read(other_path)
+        self.assertEqual(tsv, other_tsv)
+        pd.testing.assert_frame_equal(authors, other_authors)
+
+    def test_batches(self):
+        generate_corpus(self.directory, 'biorxiv', 150)
+        with get_corpus_store(self.directory, 'biorxiv') as store:
+            path = self.build(store, 'full')
+            batched_path = self.build(store, 'batched', batch_size=BATCH_SIZE)
+        self.assert_same_outputs(path, batched_path)
+
+    def test_incremental_batches_without_changes(self):
+        generate_corpus(self.directory, 'biorxiv', 40)
+        with get_corpus_store(self.directory, 'biorxiv') as store:
+            path = self.build(store, 'batched', batch_size=BATCH_SIZE)
+            tsv, authors = self.read(path)
+            self.build(store, 'batched', batch_size=BATCH_SIZE, incremental=True)
+        self.assertEqual(tsv, self.read(path)[0])
+        pd.testing.assert_frame_equal(authors, self.read(path)[1])
+
+    def test_incremental_batches_with_deletions(self):
+        generate_corpus(self.directory, 'biorxiv', 40)
+        with get_corpus_store(self.directory, 'biorxiv') as store:
+            path = self.build(store, 'batched', batch_size=BATCH_SIZE)
+            for key in sorted(store.keys())[::3]:
+                store.delete(key)
+            self.build(store, 'batched', batch_size=BATCH_SIZE, incremental=True)
+            full_path = self.build(store, 'full')
+        self.assert_same_outputs(full_path, path)
+
+    def test_empty_store(self):
+        with get_corpus_store(self.directory, 'biorxiv') as store:
+            for name, batch_size in [('full', None), ('batched', BATCH_SIZE)]:
+                with self.subTest(batch_size=batch_size):
+                    path = self.build(store, name, batch_size=batch_size)
+                    authors = self.read(path)[1]
+                    self.assertEqual(list(pd.read_csv(path, sep='\t').columns), EMPTY_SUMMARY_COLUMNS)
+                    self.assertTrue(authors.empty)
+
+    def test_process_empty_store(self):
+        path = os.path.join(self.directory, 'articles.tsv')
+        get_store = mock.patch.object(
+            biorxiv_03_process, 'get_biorxiv_articles_store',
+            lambda backend: get_corpus_store(self.directory, 'biorxiv', backend),
+        )
+        with get_store, mock.patch.object(biorxiv_03_process, 'BIORXIV_SUMMARY_PATH', path):
+            for batch_size in [None, BATCH_SIZE]:
+                with self.subTest(batch_size=batch_size):
+                    biorxiv_03_process.process(backend='directory', batch_size=batch_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
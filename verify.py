@@ -0,0 +1,218 @@
+"""Find downloaded records that are truncated, invalid, or error responses, and queue them to be downloaded again.
+
+Every record is decoded and checked in parallel:
+
+1. Figshare article listings and full records have to be objects with the id they're stored under
+2. bioRxiv day files have to be lists of publications
+3. bioRxiv article details can't be error responses
+
+A bad record is queued by removing it, since each crawler downloads whatever's missing on its
+next run. Temporary files left behind by interrupted writes are removed too. Each check is added
+to the crawl's journal (see :mod:`journal`), along with the runs that never finished. Check
+everything after a crash with ``python verify.py --jobs 0``, or only report with ``--dry-run``.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+import zlib
+from functools import partial
+from typing import Any, Callable, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import click
+from tqdm import tqdm
+
+import utils
+from biorxiv_01_download_days import get_day_problem
+from biorxiv_02_download_articles import get_details_problem
+from figshare_client import get_record_problem
+from journal import Journal
+from storage import TEMPORARY_SUFFIX, Store, backend_option, get_store, has_store, write_json
+from utils import iter_chunks, jobs_option
+
+#: The number of records sent to a checking process at a time
+CHUNK_SIZE = 1000
+
+#: Temporary files younger than this many seconds might still be being written, so they're left alone
+TEMPORARY_FILE_AGE = 60
+
+SOURCES = ('figshare', 'biorxiv')
+
+#: A function from a key and decoded record to what's wrong with it, or None if it's fine
+Check = Callable[[str, Any], Optional[str]]
+
+
+def iter_problems(
+    raw_records: Iterable[Tuple[str, bytes]], *, loads: Callable[[bytes], Any], check: Check, jobs: int = 1,
+) -> Iterable[Tuple[str, str]]:
+    """Decode and check each record with ``jobs`` processes, and get the keys of the bad ones and what's wrong."""
+    check_chunk = partial(_check_chunk, loads=loads, check=check)
+    chunks = iter_chunks(raw_records, CHUNK_SIZE)
+    if jobs == 1:
+        for chunk in chunks:
+            yield from check_chunk(chunk)
+        return
+    with multiprocessing.Pool(jobs) as pool:
+        for problems in pool.imap_unordered(check_chunk, chunks):
+            yield from problems
+
+
+def _check_chunk(chunk: List[Tuple[str, bytes]], *, loads, check: Check) -> List[Tuple[str, str]]:
+    problems = []
+    for key, data in chunk:
+        try:
+            record = loads(data)
+        except (ValueError, zlib.error) as e:  # truncated, or not JSON at all
+            problems.append((key, f'unreadable: {e}'))
+            continue
+        problem = check(key, record)
+        if problem is not None:
+            problems.append((key, problem))
+    return problems
+
+
+def verify_store(store: Store, check: Check, *, name: str, jobs: int = 1, dry_run: bool = False) -> List[str]:
+    """Check each record in a store and remove the bad ones, unless it's a dry run.
+
+    :returns: The keys of the bad records
+    """
+    keys = []
+    raw_records = tqdm(store.iter_raw(), total=len(store), desc=f'Verifying {name}', unit='record')
+    for key, problem in iter_problems(raw_records, loads=store.loads, check=check, jobs=jobs):
+        tqdm.write(f'{name}/{key}: {problem}')
+        keys.append(key)
+        if not dry_run:
+            store.delete(key)
+    return sorted(keys)
+
+
+def verify_day_files(directory: str, *, jobs: int = 1, dry_run: bool = False) -> List[str]:
+    """Check each bioRxiv day file and remove the bad ones, unless it's a dry run.
+
+    :returns: The paths of the bad day files, relative to the directory
+    """
+    paths = sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.endswith('.json')
+    )
+    raw_records = tqdm(_iter_files(directory, paths), total=len(paths), desc='Verifying day files', unit='day')
+    bad_paths = []
+    for path, problem in iter_problems(raw_records, loads=json.loads, check=get_day_problem, jobs=jobs):
+        tqdm.write(f'{path}: {problem}')
+        bad_paths.append(path)
+        if not dry_run:
+            os.remove(os.path.join(directory, path))
+    return sorted(bad_paths)
+
+
+def _iter_files(directory: str, paths: Sequence[str]) -> Iterable[Tuple[str, bytes]]:
+    for path in paths:
+        with open(os.path.join(directory, path), 'rb') as file:
+            yield path, file.read()
+
+
+def remove_temporary_files(directory: str, dry_run: bool = False) -> int:
+    """Remove the temporary files left behind by interrupted writes.
+
+    :returns: The number of temporary files found
+    """
+    now = time.time()
+    count = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if not name.endswith(TEMPORARY_SUFFIX) or now - os.stat(path).st_mtime < TEMPORARY_FILE_AGE:
+                continue
+            count += 1
+            if not dry_run:
+                os.remove(path)
+    return count
+
+
+def _report_unfinished_runs(journal: Journal) -> None:
+    for entry in journal.get_unfinished_runs():
+        click.echo(f'{entry["command"]} started at {entry["time"]} never finished')
+
+
+def verify_figshare(backend: str, jobs: int = 1, dry_run: bool = False) -> None:
+    """Verify the records of each institution that's been downloaded."""
+    if not os.path.isdir(utils.FIGSHARE_DIRECTORY):
+        return
+    for name in sorted(os.listdir(utils.FIGSHARE_DIRECTORY)):
+        institution_directory = os.path.join(utils.FIGSHARE_DIRECTORY, name)
+        if not os.path.isdir(institution_directory):
+            continue
+        journal = Journal(os.path.join(institution_directory, 'journal.jsonl'))
+        _report_unfinished_runs(journal)
+        queued = {}
+        for store_name in ('articles_short', 'articles_long'):
+            directory = os.path.join(institution_directory, store_name)
+            if not has_store(directory, backend):
+                continue
+            with get_store(directory, backend) as store:
+                queued[store_name] = verify_store(
+                    store, get_record_problem, name=f'{name}/{store_name}', jobs=jobs, dry_run=dry_run,
+                )
+        temporary_files = remove_temporary_files(institution_directory, dry_run=dry_run)
+        if queued.get('articles_short') and not dry_run:
+            _reset_sync(os.path.join(institution_directory, 'articles_short_sync.json'))
+        _finish(journal, queued, temporary_files, backend=backend, dry_run=dry_run)
+
+
+def _reset_sync(path: str) -> None:
+    """Make the next ``--sync`` list everything again, since removed listings won't show up as modified."""
+    if not os.path.exists(path):
+        return
+    with open(path) as file:
+        state = json.load(file)
+    write_json(path, {**state, 'modified_since': None}, indent=2)
+
+
+def verify_biorxiv(backend: str, jobs: int = 1, dry_run: bool = False) -> None:
+    """Verify the bioRxiv day files and article details."""
+    journal = utils.get_biorxiv_journal()
+    _report_unfinished_runs(journal)
+    queued = {}
+    if os.path.isdir(utils.BIORXIV_METADATA_DIRECTORY):
+        queued['metadata'] = verify_day_files(utils.BIORXIV_METADATA_DIRECTORY, jobs=jobs, dry_run=dry_run)
+    if has_store(utils.BIORXIV_ARTICLES_DIRECTORY, backend):
+        with utils.get_biorxiv_articles_store(backend) as store:
+            queued['articles'] = verify_store(store, get_details_problem, name='articles', jobs=jobs, dry_run=dry_run)
+    if not os.path.isdir(utils.BIORXIV_DIRECTORY):
+        return
+    temporary_files = remove_temporary_files(utils.BIORXIV_DIRECTORY, dry_run=dry_run)
+    _finish(journal, queued, temporary_files, backend=backend, dry_run=dry_run)
+
+
+def _finish(journal: Journal, queued: Mapping[str, List[str]], temporary_files: int, *, backend: str, dry_run: bool):
+    count = sum(len(keys) for keys in queued.values())
+    directory = os.path.dirname(journal.path)
+    if dry_run:
+        click.echo(f'Found {count} bad records and {temporary_files} temporary files in {directory}')
+        return
+    click.echo(f'Queued {count} bad records and removed {temporary_files} temporary files in {directory}')
+    journal.append('verify', backend=backend, queued=queued, temporary_files=temporary_files)
+
+
+@click.command()
+@click.option(
+    '--source', 'sources', type=click.Choice(SOURCES), multiple=True,
+    help='Only verify these sources. Defaults to all of them',
+)
+@backend_option
+@jobs_option
+@click.option('--dry-run', is_flag=True, help='Only report bad records, without removing them')
+def main(sources: Sequence[str], backend: str, jobs: int, dry_run: bool):
+    """Find truncated, invalid, and error response records, and queue them to be downloaded again."""
+    jobs = jobs or os.cpu_count()
+    if 'figshare' in (sources or SOURCES):
+        verify_figshare(backend, jobs=jobs, dry_run=dry_run)
+    if 'biorxiv' in (sources or SOURCES):
+        verify_biorxiv(backend, jobs=jobs, dry_run=dry_run)
+
+
+if __name__ == '__main__':
+    main()